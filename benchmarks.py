@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+'''Benchmarks of the bots modules. Run from the root of the repository: python benchmarks.py'''
+
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+import tracemalloc
+from typing import Callable
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bots'))
+import dialog_table
+import lite_update
+import meta_cache
+
+
+def _report(name:str, seconds:float, peak:int = None, **values) -> None:
+    '''Prints the result of the benchmark'''
+
+    text = f'{name}: {seconds:.3f} s'
+    if peak is not None:
+        text += f', peak memory {peak / 1024 / 1024:.1f} MB'
+
+    for key in values:
+        text += f', {key} {values[key]}'
+
+    print(text)
+
+
+def _measure(func:Callable) -> tuple:
+    '''Runs the function twice: the time is measured without tracemalloc (it slows down the code), the memory - with it'''
+
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    result = func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return seconds, peak, current, result
+
+
+def bench_dialog_table(phrases_count:int = 1_000_000, phrases_in_answer:int = 10) -> None:
+    '''Bulk loading of answers into DialogTable from csv and SQLite'''
+
+    answers_count = phrases_count // phrases_in_answer
+    rows = []
+    for i in range(answers_count):
+        phrases = '|'.join(f'phrase {i} {j}' for j in range(phrases_in_answer))
+        rows.append((f'id{i}', phrases, f'answer {i % 1000}', i % 2))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, 'answers.csv')
+        with open(csv_path, 'w', encoding='utf-8') as file:
+            for row in rows:
+                file.write(','.join(map(str, row)) + '\n')
+
+        db_path = os.path.join(tmp, 'answers.sqlite')
+        connect = sqlite3.connect(db_path)
+        connect.execute('CREATE TABLE answers (answer_id TEXT, phrases TEXT, answer TEXT, consider_case INTEGER)')
+        connect.executemany('INSERT INTO answers VALUES (?, ?, ?, ?)', rows)
+        connect.commit()
+        connect.close()
+        rows = None
+
+        for name, load in (('csv', dialog_table.DialogTable.from_file), ('sqlite', dialog_table.DialogTable.from_sqlite)):
+            path = csv_path if name == 'csv' else db_path
+            seconds, peak, current, table = _measure(lambda: load(path))
+
+            _report(f'DialogTable.from_{name} {phrases_count} phrases', seconds, peak, table_memory=f'{current / 1024 / 1024:.1f} MB')
+
+        start = time.perf_counter()
+        for i in range(100_000):
+            table.find(f'Phrase {i} 3')
+        _report('DialogTable.find x100000', time.perf_counter() - start)
+
+
+def bench_lite_update(count:int = 100_000) -> None:
+    '''Full parsing of updates by telebot against LiteMessage, when the handler reads only text and from_user.id'''
+
+    import telebot
+
+    raw_updates = []
+    for i in range(count):
+        raw_updates.append({
+            'update_id': i,
+            'message': {
+                'message_id': i, 'date': 1700000000 + i, 'text': f'message {i}',
+                'chat': {'id': -100123, 'type': 'supergroup', 'title': 'Busy group'},
+                'from': {'id': i % 500, 'is_bot': False, 'first_name': 'User', 'username': f'user{i % 500}', 'language_code': 'en'},
+                'entities': [{'type': 'bold', 'offset': 0, 'length': 7}],
+                'reply_to_message': {'message_id': i - 1, 'date': 1700000000, 'text': 'previous',
+                                     'chat': {'id': -100123, 'type': 'supergroup'}, 'from': {'id': 1, 'is_bot': False, 'first_name': 'A'}}
+            }
+        })
+
+    handlers = lite_update.LiteHandlers()
+    handlers.add(lambda message: None, ['text'])
+
+    def run(name):
+        if name == 'full':
+            updates = [telebot.types.Update.de_json(raw) for raw in raw_updates]
+        else:
+            updates = lite_update.parse_updates(raw_updates, handlers, telebot.types.Update.de_json)
+
+        for update in updates:
+            update.message.text.strip()
+            update.message.from_user.id
+
+    for name in ('full', 'lite'):
+        seconds, peak, current, _ = _measure(lambda: run(name))
+        _report(f'{name} parsing of {count} updates', seconds, peak, per_update=f'{seconds / count * 1e6:.1f} us')
+
+
+def bench_import_time(repeats:int = 7) -> None:
+    '''Start time of a notification bot generated by MotherBot: import of its module and creation of the api (without network)'''
+
+    import subprocess
+    import bots_creator
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    mother_bot = bots_creator.MotherBot(bots_creator._new_loger('MotherBotBenchmark', os.path.join(tempfile.gettempdir(), 'benchmark.log')))
+
+    code = ('import time\n'
+            'start = time.perf_counter()\n'
+            'import {name}\n'
+            '{name}.BenchBot("123:TOKEN").api\n'
+            'print(time.perf_counter() - start)')
+
+    cwd = os.getcwd()
+    os.chdir(root)
+
+    try:
+        for send_only in (False, True):
+            name = f'bench_bot_{int(send_only)}'
+            mother_bot.create_bot(name, [0], class_name='BenchBot', send_only=send_only)
+
+            times = []
+            try:
+                for i in range(repeats):
+                    result = subprocess.run([sys.executable, '-c', code.format(name=name)], cwd=os.path.join(root, 'bots'),
+                                            capture_output=True, text=True, check=True)
+                    times.append(float(result.stdout))
+            finally:
+                os.remove(os.path.join(root, 'bots', name + '.py'))
+
+            _report(f'start of the generated bot, send_only={send_only}', sorted(times)[len(times) // 2], repeats=repeats)
+    finally:
+        os.chdir(cwd)
+
+
+def bench_meta_cache(messages:int = 1000, users:int = 50, latency:float = 0.005) -> None:
+    '''Membership check on each message: a request to telegram (simulated by a pause) against MetaCache'''
+
+    def get_chat_member(chat_id, user_id):
+        time.sleep(latency)
+        return {'status': 'member'}
+
+    cache = meta_cache.MetaCache()
+
+    for name in ('direct', 'cached'):
+        start = time.perf_counter()
+        for i in range(messages):
+            user_id = i % users
+            if name == 'direct':
+                get_chat_member(-100, user_id)
+            else:
+                cache.get('get_chat_member', ('-100', str(user_id)), lambda: get_chat_member(-100, user_id))
+
+        seconds = time.perf_counter() - start
+        _report(f'{name} get_chat_member on {messages} messages', seconds, per_message=f'{seconds / messages * 1e3:.3f} ms',
+                hit_rate=f"{cache.stats()['hit_rate']:.3f}" if name == 'cached' else '-')
+
+
+BENCHMARKS = {
+    'dialog_table': bench_dialog_table,
+    'lite_update': bench_lite_update,
+    'import_time': bench_import_time,
+    'meta_cache': bench_meta_cache,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+
+    for name in names:
+        BENCHMARKS[name]()
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+'''Module for controlling the updates that accumulated while the bot was not working'''
+
+import os
+import time
+import threading as th
+from typing import List
+
+
+#The lists of telebot handlers and the types of updates that they process
+HANDLER_UPDATE_TYPES = {
+    'message_handlers': 'message',
+    'edited_message_handlers': 'edited_message',
+    'channel_post_handlers': 'channel_post',
+    'edited_channel_post_handlers': 'edited_channel_post',
+    'message_reaction_handlers': 'message_reaction',
+    'message_reaction_count_handlers': 'message_reaction_count',
+    'inline_handlers': 'inline_query',
+    'chosen_inline_handlers': 'chosen_inline_result',
+    'callback_query_handlers': 'callback_query',
+    'shipping_query_handlers': 'shipping_query',
+    'pre_checkout_query_handlers': 'pre_checkout_query',
+    'poll_handlers': 'poll',
+    'poll_answer_handlers': 'poll_answer',
+    'my_chat_member_handlers': 'my_chat_member',
+    'chat_member_handlers': 'chat_member',
+    'chat_join_request_handlers': 'chat_join_request',
+    'chat_boost_handlers': 'chat_boost',
+    'removed_chat_boost_handlers': 'removed_chat_boost',
+    'business_connection_handlers': 'business_connection',
+    'business_message_handlers': 'business_message',
+    'edited_business_message_handlers': 'edited_business_message',
+    'deleted_business_messages_handlers': 'deleted_business_messages',
+    'purchased_paid_media_handlers': 'purchased_paid_media',
+}
+
+#Update fields that have a chat and a date
+_DATED_FIELDS = ('message', 'edited_message', 'channel_post', 'edited_channel_post', 'business_message', 'edited_business_message',
+                 'my_chat_member', 'chat_member', 'chat_join_request')
+
+
+def allowed_updates(api) -> List[str]:
+    '''
+    Returns the types of updates for which the bot has handlers. None - if there are no handlers (then telegram sends everything)
+    or if there are handlers of a type that is not in HANDLER_UPDATE_TYPES (a newer telebot): they must not lose their updates
+    ----------------------
+    api: telebot.TeleBot - the bot whose handlers are checked
+    '''
+
+    if unknown_handlers(api):
+        return None
+
+    types = [update_type for attr, update_type in HANDLER_UPDATE_TYPES.items() if getattr(api, attr, None)]
+
+    return types or None
+
+
+def unknown_handlers(api) -> List[str]:
+    '''Names of the non-empty lists of handlers of the bot whose type of updates is unknown (not in HANDLER_UPDATE_TYPES)'''
+
+    return [attr for attr, value in vars(api).items()
+            if attr.endswith('_handlers') and attr not in HANDLER_UPDATE_TYPES and isinstance(value, list) and value]
+
+
+class OffsetStore:
+    '''
+    Stores the id of the last processed update in a file, so that after a restart the bot continues from the same place
+    ----------------------
+    methods:
+       load - Returns the saved update_id (0 if there is no file)
+       save - Saves the update_id
+    '''
+
+    def __init__(self, path:str, min_interval:float = 0.0):
+        '''
+        path:str - the file where the update_id is stored
+        min_interval:float - do not write the file more often than once in this number of seconds
+        '''
+
+        self.path = path
+        self.min_interval = min_interval
+
+        self._saved_id = None
+        self._last_save = 0.0
+        self._lock = th.Lock()
+
+
+    def load(self) -> int:
+        '''Returns the saved update_id (0 if there is no file)'''
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                self._saved_id = int(file.read().strip() or 0)
+        except (OSError, ValueError):
+            self._saved_id = 0
+
+        return self._saved_id
+
+
+    def save(self, update_id:int, force:bool = False) -> None:
+        '''
+        Saves the update_id. The file is replaced entirely, so it cannot be half-written
+        ----------------------
+        update_id:int - id of the last processed update
+        force:bool - write even if min_interval has not passed
+        '''
+
+        with self._lock:
+            if update_id == self._saved_id:
+                return
+
+            now = time.monotonic()
+            if not force and now - self._last_save < self.min_interval:
+                return
+
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                file.write(str(update_id))
+            os.replace(tmp_path, self.path)
+
+            self._saved_id = update_id
+            self._last_save = now
+
+
+class BacklogPolicy:
+    '''
+    Decides which of the accumulated updates need to be processed. Updates are considered accumulated
+    if they were sent before the bot started. Live updates are always passed to the handlers.
+    ----------------------
+    methods:
+       filter - Returns the updates that need to be processed
+    '''
+
+    def __init__(self, max_age:float = None, latest_per_chat:bool = False, max_rate:float = None):
+        '''
+        max_age:float - skip accumulated updates older than this number of seconds. None - do not skip
+        latest_per_chat:bool - from the accumulated messages of one chat, process only the last one. The messages are held
+           until the whole backlog is received (several answers of telegram), so one chat gets one answer
+        max_rate:float - process accumulated updates no faster than this number per second. None - without limit
+        '''
+
+        self.max_age = max_age
+        self.latest_per_chat = latest_per_chat
+        self.max_rate = max_rate
+
+        self.started = time.time()
+        self.stats = {'processed': 0, 'skipped_old': 0, 'skipped_replaced': 0}
+        #An answer with fewer updates means that the backlog is received. Telegram gives up to 100, adaptive polling sets its limit
+        self.batch_limit = 100
+
+        self._next_time = 0.0
+        self._held = {} #chat_id -> the last accumulated update of the chat, while the backlog is being received
+
+
+    def filter(self, updates:list) -> list:
+        '''Returns the updates that need to be processed'''
+
+        now = time.time()
+        result = []
+        backlog_count = 0
+        live = False
+
+        for update in updates:
+            date, chat_id = _date_and_chat(update)
+
+            if date is None or date >= self.started:
+                live = live or date is not None
+                result.append(update)
+                continue
+
+            if self.max_age is not None and now - date > self.max_age:
+                self.stats['skipped_old'] += 1
+                continue
+
+            if self.latest_per_chat and chat_id is not None:
+                if self._held.pop(chat_id, None) is not None:
+                    self.stats['skipped_replaced'] += 1
+                self._held[chat_id] = update
+                continue
+
+            result.append(update)
+            backlog_count += 1
+
+        if self._held and (live or len(updates) < self.batch_limit):
+            #The backlog is received: the last message of each chat goes before the live updates
+            backlog_count += len(self._held)
+            result = list(self._held.values()) + result
+            self._held = {}
+
+        self.stats['processed'] += len(result)
+
+        if self.max_rate and backlog_count:
+            self._wait(backlog_count)
+
+        return result
+
+
+    def _wait(self, count:int) -> None:
+        '''Pauses the polling so that the accumulated updates do not go faster than max_rate'''
+
+        now = time.monotonic()
+        start = max(now, self._next_time)
+        self._next_time = start + count / self.max_rate
+
+        if start > now:
+            time.sleep(start - now)
+
+
+def _date_and_chat(update) -> tuple:
+    '''Returns the date and chat id of the update, or (None, None) if the update has no date'''
+
+    for field in _DATED_FIELDS:
+        obj = getattr(update, field, None)
+        if obj is None:
+            continue
+
+        date = getattr(obj, 'edit_date', None) or getattr(obj, 'date', None)
+        chat = getattr(obj, 'chat', None)
+
+        return date, (chat.id if chat is not None else None)
+
+    return None, None
@@ -1,9 +1,27 @@
 # -*- coding: utf-8 -*-
-'''Module with the parent class of telegram bot'''
+'''
+Module with the parent class of telegram bot.
+telebot (and requests with it) is imported only when the bot really needs it, see TelegramBotParent.api
+'''
 
-import telebot
+import time
+import backlog
+import circuit
+import long_poll
+import media_cache
+import meta_cache
+import outbound
+import lite_update
+import profiler
+import dedup
+import scheduler
+import tail_follow
 import threading as th
-from typing import Callable, List
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import TYPE_CHECKING, Callable, List
+
+if TYPE_CHECKING:
+    import telebot
 
 
 class TelegramBotParent:
@@ -13,22 +31,88 @@ class TelegramBotParent:
     methods:
        add_listening - Add listening to messages from telegram
        add_keyboard_listening - Add listening pressing the button
+       add_batch_listening - Add a handler that receives all updates of one answer of telegram at once
        make_inline_keyboard - Creates a keyboard object to be used when sending a message to the user
        start_listen - Start listening to messages - it is START
+       stop_listen - Stop listening to messages
+       polling_stats - Statistics of the adaptive polling
+       add_trigger - Add a periodic trigger (for example, a notification check)
+       start_triggers - Start all triggers in one scheduler thread
+       add_tail_trigger - Send new lines of growing files (logs) that match the patterns
+       send - Sending a message to a user or to a chat
+       reply - Answer to the user ahead of broadcasts
+       api_call - Call any method of the api through the queue of outgoing requests
+       circuit_stats - State of the connection with telegram
+       get_me, get_chat, get_chat_member - Data of the bot, chat and member through the cache (see metadata_stats)
+       enable_profiling - Turn on the sampling profiler of handlers while the bot is running
+       dump_profile - Stacks collected by the profiler in the flamegraph format
+       send_media - Sending a file (document, photo, video...), each file is uploaded to telegram only once
     '''
 
-    def __init__(self, token:str, parse_mode:str = None):
+    def __init__(self, token:str, parse_mode:str = None, media_cache_file:str = None, dedup_file:str = None, send_only:bool = False):
         '''
         Init new bot by parameters
         ----------------------
         token:str - bot token received from https://t.me/BotFather
         parse_mode: str/None - how to format text, HTML or MARKDOWN (None = usual text)
+        media_cache_file: str/None - file where the file_id of uploaded media is saved (None = only in memory)
+        dedup_file: str/None - SQLite database where the keys of sent notifications are saved, so that after a restart they are not sent again (None = only in memory)
+        send_only: bool - the bot only sends messages (notifications): self.api is notify.NotifyApi, telebot is not imported at all.
+                          Listening and media do not work in this mode
         '''
 
-        self.api = telebot.TeleBot(token, parse_mode)
+        self.token = token
+        self.parse_mode = parse_mode
+        self.send_only = send_only
+        self._api = None
+        self._api_lock = th.Lock()
+
+        self.media_cache = media_cache.FileIdCache(media_cache_file)
+        self.meta_cache = meta_cache.MetaCache()
+        self.dedup = dedup.DedupStore(dedup_file)
+        self.outbound = outbound.OutboundScheduler()
+        self.lite_handlers = lite_update.LiteHandlers()
+
+        #Handlers, triggers and requests to telegram are wrapped by the profiler, it is turned on by enable_profiling
+        self.profiler = profiler.Profiler()
+        self.outbound.profiler = self.profiler
+
+        #When telegram or the network fails, requests are paused instead of waiting for timeouts, see circuit_stats
+        self.circuit = circuit.CircuitBreaker()
+        self.outbound.circuit = self.circuit
+        self.scheduler = scheduler.Scheduler()
+
+        self.batch_handlers = []
+        self.backlog_policy = None
+        self.offset_store = None
+        self.polling = None
+        self._polling_stop = th.Event()
+
+
+    @property
+    def api(self):
+        '''telebot.TeleBot of the bot (notify.NotifyApi if send_only). It is created at the first access'''
 
+        if self._api is None:
+            with self._api_lock:
+                if self._api is None:
+                    if self.send_only:
+                        import notify
+                        self._api = notify.NotifyApi(self.token, self.parse_mode)
+                    else:
+                        import telebot
+                        self._api = telebot.TeleBot(self.token, self.parse_mode)
 
-    def add_listening(self, handler:Callable, content_types:List[str] = None, commands:List[str] = None, func:Callable = None) -> None:
+        return self._api
+
+
+    @api.setter
+    def api(self, api) -> None:
+        self._api = api
+
+
+    def add_listening(self, handler:Callable, content_types:List[str] = None, commands:List[str] = None, func:Callable = None,
+                      lite:bool = False) -> None:
         '''
         Add listening to messages from telegram
         ----------------------
@@ -38,12 +122,20 @@ class TelegramBotParent:
            group_chat_created, supergroup_chat_created, channel_chat_created, migrate_to_chat_id, migrate_from_chat_id, pinned_message, web_app_data)
         commands: List[str] - like ['start', 'help'], denotes commands like /start, /help
         func : function - the filter function should return True if the message fits. Like lambda msg: msg.document.mime_type == 'text/plain'
+        lite: bool - the handler receives lite_update.LiteMessage instead of telebot.types.Message: a thin view over the json,
+           nested fields are created only when accessed (message.full() gives the full object). Faster for busy groups.
+           Lite handlers are checked before the usual ones
         '''
 
         if content_types is None:
             content_types = ['text']
 
-        self.api.message_handler(content_types=content_types, commands=commands, func=func)(handler)
+        handler = self.profiler.wrap(handler)
+
+        if lite:
+            self.lite_handlers.add(handler, content_types, commands, func)
+        else:
+            self.api.message_handler(content_types=content_types, commands=commands, func=func)(handler)
 
 
     def add_keyboard_listening(self, handler:Callable, func:Callable = None) -> None:
@@ -56,10 +148,23 @@ class TelegramBotParent:
 
         if func is None:
             func = lambda call: True
-        self.api.callback_query_handler(func=func)(handler)
+        self.api.callback_query_handler(func=func)(self.profiler.wrap(handler))
 
 
-    def make_inline_keyboard(self, buttons) -> telebot.types.InlineKeyboardMarkup:
+    def add_batch_listening(self, handler:Callable, update_types:List[str] = None) -> None:
+        '''
+        Add a handler that receives all updates of one answer of telegram at once, for example to write them to a database in one transaction.
+        It works in addition to the usual handlers
+        ----------------------
+        handler: function - a function like function(items), where items is a list of messages (or other objects of the update type).
+           They are always objects of telebot, also for messages that go to lite handlers
+        update_types: List[str] - types of updates: message, edited_message, callback_query... By default, message
+        '''
+
+        self.batch_handlers.append((self.profiler.wrap(handler), update_types or ['message']))
+
+
+    def make_inline_keyboard(self, buttons) -> 'telebot.types.InlineKeyboardMarkup':
         '''
         Creates a keyboard object to be used when sending a message to the user. Something like send_message(user_id, text, reply_markup=KEYBOARD)
         A keyboard handler is required to work
@@ -71,6 +176,8 @@ class TelegramBotParent:
             string and other = button name and button key = index
         '''
 
+        import telebot
+
         keyboard = telebot.types.InlineKeyboardMarkup()
 
         if isinstance(buttons, list):
@@ -97,18 +204,282 @@ class TelegramBotParent:
         return keyboard
 
 
-    def start_listen(self, separate_thread:bool = True) -> None:
+    def start_listen(self, separate_thread:bool = True, offset_file:str = None, max_age:float = None, latest_per_chat:bool = False,
+                     max_rate:float = None, only_handled_updates:bool = True, adaptive:bool = False) -> None:
         '''
         Start listening to messages
         ----------------------
         separate_thread:bool - Whether to run in a separate thread or loop execution here
+        offset_file:str - file where the id of the last processed update is saved. After a restart, the bot continues from it
+        max_age:float - skip updates that were sent more than this number of seconds ago while the bot was not working
+        latest_per_chat:bool - from the messages accumulated while the bot was not working, answer only the last one in each chat
+        max_rate:float - process the accumulated updates no faster than this number per second
+        only_handled_updates:bool - request from telegram only the types of updates for which there are handlers
+        adaptive:bool - the timeout and the batch size of polling adapt to the flow of updates (see long_poll.AdaptivePolling and polling_stats)
+        '''
+
+        if offset_file is not None:
+            self.offset_store = backlog.OffsetStore(offset_file)
+            self.api.last_update_id = max(self.api.last_update_id, self.offset_store.load())
+        else:
+            self.offset_store = None
+
+        if max_age is not None or latest_per_chat or max_rate:
+            self.backlog_policy = backlog.BacklogPolicy(max_age, latest_per_chat, max_rate)
+        else:
+            self.backlog_policy = None
+
+        if self.lite_handlers:
+            self._wrap_get_updates()
+
+        self._wrap_circuit()
+
+        if self.offset_store is not None or self.backlog_policy is not None or self.lite_handlers or self.batch_handlers:
+            self._wrap_process_updates()
+
+        allowed_updates = self._allowed_updates() if only_handled_updates else None
+
+        if adaptive:
+            self.polling = long_poll.AdaptivePolling()
+            target = self._adaptive_polling
+        else:
+            target = self.api.infinity_polling
+
+        self._polling_stop.clear()
+
+        if separate_thread:
+            tread_handler = th.Thread(target=target, kwargs={'allowed_updates': allowed_updates})
+            tread_handler.start()
+        else:
+            target(allowed_updates=allowed_updates)
+
+
+    def stop_listen(self) -> None:
+        '''Stop listening to messages'''
+
+        self._polling_stop.set()
+        self.api.stop_polling()
+
+
+    def polling_stats(self) -> dict:
+        '''Statistics of the adaptive polling: polls, empty_polls, updates, round_trips_per_update, current timeout and limit'''
+
+        if self.polling is None:
+            return {}
+
+        return self.polling.stats()
+
+
+    def _allowed_updates(self) -> List[str]:
+        '''Types of updates for the handlers of telebot, lite and batch handlers. None - there are no handlers, telegram sends everything'''
+
+        allowed_updates = backlog.allowed_updates(self.api)
+        if backlog.unknown_handlers(self.api):
+            return None
+
+        wanted = ['message'] if self.lite_handlers else []
+        for handler, update_types in self.batch_handlers:
+            wanted += update_types
+
+        #Without handlers of telebot the list is still needed: otherwise telegram keeps the allowed_updates of the previous request
+        if wanted and allowed_updates is None:
+            allowed_updates = []
+
+        for update_type in wanted:
+            if update_type not in allowed_updates:
+                allowed_updates.append(update_type)
+
+        return allowed_updates
+
+
+    def _adaptive_polling(self, allowed_updates:List[str] = None) -> None:
+        '''Polling loop with the parameters of self.polling'''
+
+        last_answer = time.monotonic()
+
+        while not self._polling_stop.is_set():
+            timeout, limit = self.polling.params()
+
+            try:
+                updates = self.api.get_updates(offset=self.api.last_update_id + 1, limit=limit, timeout=timeout,
+                                               allowed_updates=allowed_updates, long_polling_timeout=timeout)
+            except Exception as err:
+                print(f'''Failed to get updates\nfile: {__file__}\nerror: {err!r}''')
+                self._polling_stop.wait(3)
+                continue
+
+            #The flow is estimated by the time between answers: processing and the pause are included
+            now = time.monotonic()
+            self.polling.observe(len(updates), now - last_answer)
+            last_answer = now
+
+            if self.backlog_policy is not None:
+                self.backlog_policy.batch_limit = limit
+
+            self.api.process_new_updates(updates)
+
+            delay = self.polling.delay()
+            if delay:
+                self._polling_stop.wait(delay)
+
+
+    def _wrap_get_updates(self) -> None:
+        '''Messages for lite handlers are not parsed into telebot objects'''
+
+        if getattr(self, '_get_updates_wrapped', False):
+            return
+        self._get_updates_wrapped = True
+
+        import telebot
+
+        def get_updates(offset=None, limit=None, timeout=20, allowed_updates=None, long_polling_timeout=20):
+            json_updates = telebot.apihelper.get_updates(self.api.token, offset=offset, limit=limit, timeout=timeout,
+                                                         allowed_updates=allowed_updates, long_polling_timeout=long_polling_timeout)
+            return lite_update.parse_updates(json_updates, self.lite_handlers, telebot.types.Update.de_json)
+
+        self.api.get_updates = get_updates
+
+
+    def _wrap_circuit(self) -> None:
+        '''Polling does not request telegram while the circuit is open, it waits for the probe'''
+
+        if getattr(self, '_circuit_wrapped', False):
+            return
+        self._circuit_wrapped = True
+
+        get_updates = self.api.get_updates
+
+        def guarded_get_updates(*args, **kwargs):
+            wait = self.circuit.acquire()
+            while wait:
+                if self._polling_stop.wait(wait):
+                    return []
+                wait = self.circuit.acquire()
+
+            if self.circuit.state == circuit.HALF_OPEN:
+                #This request is the probe: a long poll would hold it (and the waiting outbound requests) for the whole timeout
+                kwargs['timeout'] = kwargs['long_polling_timeout'] = 1
+
+            try:
+                updates = get_updates(*args, **kwargs)
+            except Exception as err:
+                self.circuit.record(self.circuit.is_failure(err))
+                raise
+
+            #Long polling is slow by design, its duration is not checked
+            self.circuit.record(False)
+            return updates
+
+        self.api.get_updates = guarded_get_updates
+
+
+    def _wrap_process_updates(self) -> None:
+        '''Filters the received updates by backlog_policy, passes lite updates to their handlers and saves the offset after processing'''
+
+        if getattr(self, '_process_updates_wrapped', False):
+            return
+        self._process_updates_wrapped = True
+
+        process_new_updates = self.api.process_new_updates
+
+        def process(updates):
+            #An empty answer is also passed to backlog_policy: it means that the backlog is received
+            if not updates and self.backlog_policy is None:
+                return
+
+            last_id = max((update.update_id for update in updates), default=0)
+
+            if self.backlog_policy is not None:
+                updates = self.backlog_policy.filter(updates)
+
+            for handler, update_types in self.batch_handlers:
+                items = [getattr(update, update_type) for update in updates for update_type in update_types]
+                #Messages of lite handlers are given in the same form as the others
+                items = [item.full() if isinstance(item, lite_update.LiteMessage) else item for item in items if item is not None]
+                if items:
+                    self.api._exec_task(handler, items)
+
+            full_updates = []
+            for update in updates:
+                if isinstance(update, lite_update.LiteUpdate):
+                    self.api._exec_task(update.handler, update.message)
+                else:
+                    full_updates.append(update)
+
+            process_new_updates(full_updates)
+
+            #Skipped updates are also considered processed, so as not to receive them again
+            if last_id > self.api.last_update_id:
+                self.api.last_update_id = last_id
+
+            if self.offset_store is not None:
+                self.offset_store.save(self.api.last_update_id)
+
+        self.api.process_new_updates = process
+
+
+    def add_trigger(self, func:Callable, interval:float = None, cron:str = None, jitter:float = 0.0, args:tuple = (), kwargs:dict = None,
+                    name:str = None, stop_on_result:bool = False, run_now:bool = False) -> scheduler.Trigger:
+        '''
+        Add a periodic trigger. All triggers work in one thread, so there is no need for a separate loop for each of them
+        ----------------------
+        func: function - what to run, for example self.notificationTrigger
+        interval:float - launch every interval seconds
+        cron:str - or launch by cron-style schedule "minute hour day month weekday", like "0 9 * * 1-5"
+        jitter:float - random delay from 0 to jitter seconds is added to each launch
+        args: tuple, kwargs: dict - parameters of the function
+        name:str - trigger name in the statistics. By default, the name of the function
+        stop_on_result:bool - stop the trigger when the function returns a truthy value (e.g. a non-zero status code)
+        run_now:bool - the first launch immediately, and not after the interval
+        '''
+
+        name = name or getattr(func, '__name__', repr(func))
+        return self.scheduler.add(self.profiler.wrap(func, 'trigger:' + name), interval, cron, jitter, args, kwargs, name, stop_on_result, run_now)
+
+
+    def add_tail_trigger(self, paths:List[str], chat_id, patterns:List[str] = None, interval:float = 1.0, state_file:str = None,
+                         from_start:bool = False) -> tail_follow.TailNotifier:
+        '''
+        Send new lines of growing files (logs) that match the patterns. Only appended bytes are read, rotation and truncation of files are taken into account.
+        Works on the scheduler, so start_triggers is needed
+        ----------------------
+        paths: List[str] - files to follow
+        chat_id: - who to send the lines to. You can pass a list
+        patterns: List[str] - regular expressions. A line is sent if at least one of them is found in it. None - all lines
+        interval:float - how often to check the files, in seconds
+        state_file:str - file where positions in files are saved, so that after a restart only new lines are sent
+        from_start:bool - read the files from the beginning (if there is no saved position)
         '''
 
-        tread_handler = th.Thread(target=self.api.infinity_polling)
-        tread_handler.start()
+        notifier = tail_follow.TailNotifier(paths, patterns or [], lambda text: self.send(text, chat_id), state_file, from_start)
+        self.add_trigger(notifier.check, interval, name='tail:' + ','.join(paths))
 
+        return notifier
 
-    def send(self, msg, chat_id, keyboard=None):
+
+    def start_triggers(self, separate_thread:bool = True) -> None:
+        '''
+        Start all triggers. The scheduler works until stop_triggers is called or until all triggers are stopped
+        ----------------------
+        separate_thread:bool - Whether to run in a separate thread or loop execution here
+        '''
+
+        self.scheduler.start(separate_thread)
+
+
+    def stop_triggers(self) -> None:
+        '''Stop all triggers'''
+
+        self.scheduler.stop()
+
+
+    def trigger_stats(self) -> dict:
+        '''Launch statistics of the triggers: runs, errors, overruns, avg_time, max_time, max_lateness, last_result'''
+
+        return self.scheduler.stats()
+
+
+    def send(self, msg, chat_id, keyboard=None, lane:str = None, wait:bool = True, event:str = None):
         '''
         Sending a message to a user or to a chat
         ----------------------
@@ -116,17 +487,278 @@ class TelegramBotParent:
         chat_id: - the chat ID of the user or channel to send a message from the bot. You can pass a list.
                    IMPORTANT: you can only send a message to a user who has written to the bot at least 1 time
         keyboard: - The keyboard object that will be shown to the user
+        lane: str - priority of sending: interactive, normal or bulk. By default, normal for one chat and bulk for a list
+        wait: bool - wait until the messages are sent. If False, the messages are sent in the background.
+                     While telegram is unavailable (see circuit_stats), the messages are buffered without waiting
+        event: str - what caused the message, for example "data.txt changed at 1700000000". If specified, the same message
+           about the same event is sent to each chat only once, even after retries and restarts (see dedup_stats)
+        '''
+
+        if wait and self.circuit.blocked():
+            print('WARNING: Telegram is unavailable, the messages are buffered and will be sent when it works again')
+            wait = False
+
+        if isinstance(chat_id, str) or isinstance(chat_id, int):
+            chat_ids = [str(chat_id)]
+            lane = lane or 'normal'
+        else:
+            chat_ids = list(chat_id)
+            lane = lane or 'bulk'
+
+        if event is not None:
+            #The keys of all chats are reserved with one write to the database
+            keys = [dedup.make_key(user_id, msg, event) for user_id in chat_ids]
+            reserved = self.dedup.reserve_many(keys)
+        else:
+            keys = [None] * len(chat_ids)
+            reserved = [True] * len(chat_ids)
+
+        futures = []
+        for user_id, key, free in zip(chat_ids, keys, reserved):
+            if not free:
+                continue
+
+            send_message = self.api.send_message if key is None else self._release_on_error(self.api.send_message, key)
+            future = self.outbound.submit(send_message, user_id, str(msg), reply_markup=keyboard, lane=lane)
+            if key is not None:
+                #A message dropped from the full queue was not sent, it may be sent again later
+                future.add_done_callback(lambda done, key=key: self._release_if_dropped(done, key))
+            futures.append((user_id, future))
+
+        if not wait:
+            return
+
+        for user_id, future in futures:
+            try:
+                future.result()
+            except:
+                print(f'''Failed to send message\nfile: {__file__}\nmsg: {msg}\nchat_id: {user_id}\nkeyboard: {keyboard}''')
+
+
+    def _release_if_dropped(self, future, key:str) -> None:
+        '''Releases the idempotency key of the message that was dropped from the queue without sending'''
+
+        if not future.cancelled() and isinstance(future.exception(), outbound.QueueOverflow):
+            self.dedup.release(key)
+
+
+    def _release_on_error(self, func:Callable, key:str) -> Callable:
+        '''
+        Wraps the sending so that the idempotency key is released if telegram surely did not accept the message, so a retry is possible.
+        After a timeout the message may have been delivered, then the key is kept (see dedup.not_delivered)
+        '''
+
+        def send_message(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            except Exception as err:
+                if dedup.not_delivered(err):
+                    self.dedup.release(key)
+                raise
+
+        return send_message
+
+
+    def dedup_stats(self) -> dict:
+        '''Statistics of sending with an event: sent, suppressed (duplicates that were not sent), released (failed and can be retried)'''
+
+        return dict(self.dedup.stats)
+
+
+    def reply(self, msg, chat_id, keyboard=None):
+        '''
+        Answer to the user. Goes through the interactive lane, so it is not delayed by broadcasts. Returns the sent message
+        ----------------------
+        msg: str - a message to be sent
+        chat_id: - the chat ID of the user
+        keyboard: - The keyboard object that will be shown to the user
+        '''
+
+        return self.api_call(self.api.send_message, chat_id, str(msg), reply_markup=keyboard)
+
+
+    def api_call(self, func:Callable, *args, lane:str = 'interactive', max_wait:float = 30.0, **kwargs):
+        '''
+        Call any method of the api through the queue of outgoing requests and wait for the result. Like api_call(self.api.edit_message_text, ...)
+        While telegram is unavailable (see circuit_stats), circuit.CircuitOpenError is raised at once, so that handlers do not hang
+        ----------------------
+        func: function - method of self.api
+        lane: str - priority: interactive, normal or bulk
+        max_wait: float - how many seconds the request may wait in the queue. Then it is cancelled and TimeoutError is raised
         '''
 
+        if self.circuit.blocked():
+            raise circuit.CircuitOpenError('Telegram is unavailable, the request was not sent')
+
+        future = self.outbound.submit(func, *args, lane=lane, **kwargs)
+
         try:
-            if isinstance(chat_id, str) or isinstance(chat_id, int):
-                chat_id = str(chat_id)
-                self.api.send_message(chat_id, str(msg), reply_markup=keyboard)
-            else:
-                for user_id in chat_id:
-                    self.api.send_message(user_id, str(msg), reply_markup=keyboard)
-        except:
-            print(f'''Failed to send message\nfile: {__file__}\nmsg: {msg}\nchat_id: {chat_id}\nkeyboard: {keyboard}''')
+            return future.result(max_wait)
+        except FutureTimeoutError:
+            if not future.cancel():
+                #The request is already being performed, its result will come soon
+                return future.result()
+            raise TimeoutError(f'The request was not sent in {max_wait} s')
+
+
+    def outbound_stats(self) -> dict:
+        '''Statistics of outgoing requests for each lane: sent, errors, forced, dropped, queued, p50, p99, max (latency in seconds)'''
+
+        return self.outbound.stats()
+
+
+    def circuit_stats(self) -> dict:
+        '''State of the connection with telegram: state (closed, open, half_open), calls, failures, slow, rejected, opened, retry_in'''
+
+        return self.circuit.stats()
+
+
+    def get_me(self):
+        '''Data of the bot (telebot.types.User). The answer is cached, see meta_cache.TTLS'''
+
+        return self.meta_cache.get('get_me', (), lambda: self.api_call(self.api.get_me))
+
+
+    def get_chat(self, chat_id):
+        '''Data of the chat (telebot.types.Chat). The answer and the error "chat not found" are cached'''
 
+        return self.meta_cache.get('get_chat', (str(chat_id),), lambda: self.api_call(self.api.get_chat, chat_id))
+
+
+    def get_chat_member(self, chat_id, user_id):
+        '''
+        Member of the chat (telebot.types.ChatMember), for example to check that the user is subscribed to the channel.
+        The answer is cached, call self.meta_cache.invalidate('get_chat_member') if the membership must be checked right now
+        '''
+
+        return self.meta_cache.get('get_chat_member', (str(chat_id), str(user_id)), lambda: self.api_call(self.api.get_chat_member, chat_id, user_id))
+
+
+    def metadata_stats(self) -> dict:
+        '''Statistics of the cache of get_me, get_chat and get_chat_member: hits, negative_hits, misses, shared, hit_rate, size'''
+
+        return self.meta_cache.stats()
+
+
+    def send_media(self, path:str, chat_id, kind:str = 'document', caption:str = None, keyboard=None) -> None:
+        '''
+        Sending a file to a user or to a chat. The file is uploaded once, then the file_id returned by telegram is used for any chat
+        (the cache is by the contents of the file, so a changed file is uploaded again)
+        ----------------------
+        path: str - path to the file. It is uploaded in chunks while it is being sent, without reading it into memory
+           (in workers of supervisor the request goes through the supervisor, and the file is read there)
+        chat_id: - the chat ID of the user or channel. You can pass a list
+        kind: str - document, photo, video, audio, animation, voice, video_note or sticker
+        caption: str - text under the file (not for video_note and sticker)
+        keyboard: - The keyboard object that will be shown to the user
+        '''
+
+        if kind not in media_cache.MEDIA_FIELDS:
+            raise ValueError(f'Unknown type of media: {kind}')
+
+        import telebot
+
+        if self.circuit.blocked():
+            print(f'''WARNING: Telegram is unavailable, the file {path} was not sent''')
+            return
+
+        method = getattr(self.api, 'send_' + kind)
+        params = {'reply_markup': keyboard}
+        if caption is not None:
+            params['caption'] = caption
+
+        if isinstance(chat_id, str) or isinstance(chat_id, int):
+            chat_id = [str(chat_id)]
+            lane = 'normal'
+        else:
+            lane = 'bulk'
+
+        for user_id in chat_id:
+            try:
+                file_id = self.media_cache.get(path, kind)
+
+                if file_id is not None:
+                    try:
+                        self.api_call(method, user_id, file_id, lane=lane, **params)
+                        continue
+                    except telebot.apihelper.ApiTelegramException as err:
+                        if not media_cache.is_file_id_error(err):
+                            #The error of this chat (for example, the bot was blocked), the file_id is still valid
+                            raise
+
+                        #Telegram no longer accepts the file_id, upload the file again
+                        self.media_cache.forget(path, kind)
+
+                if telebot.apihelper.CUSTOM_REQUEST_SENDER is not None:
+                    #The requests are sent by someone else (supervisor): only telebot knows how to pass them
+                    with open(path, 'rb') as file:
+                        message = self.api_call(method, user_id, file, lane=lane, **params)
+                else:
+                    message = self.api_call(self._upload, kind, user_id, path, lane=lane, **params)
+
+                self.media_cache.put(path, kind, media_cache.file_id_of(message, kind))
+
+            except:
+                print(f'''Failed to send file\nfile: {__file__}\npath: {path}\nchat_id: {user_id}\nkind: {kind}''')
+
+
+    def _upload(self, kind:str, chat_id, path:str, caption:str = None, reply_markup=None) -> 'telebot.types.Message':
+        '''
+        Uploads the file with the request send_<kind>. Unlike telebot, the body is streamed from the disk (media_cache.MultipartStream),
+        so a large file is not loaded into memory. Errors are the same as in telebot (ApiTelegramException)
+        '''
+
+        import telebot
+
+        method_name = 'send' + ''.join(part.capitalize() for part in kind.split('_'))
+        url = (telebot.apihelper.API_URL or 'https://api.telegram.org/bot{0}/{1}').format(self.token, method_name)
+
+        fields = {
+            'chat_id': chat_id,
+            'caption': caption,
+            'parse_mode': self.parse_mode if caption is not None else None,
+            'reply_markup': reply_markup.to_json() if reply_markup is not None else None,
+        }
+
+        body = media_cache.MultipartStream(fields, kind, path)
+        try:
+            result = telebot.apihelper._get_req_session().post(url, data=body, headers={'Content-Type': body.content_type},
+                                                                 timeout=(telebot.apihelper.CONNECT_TIMEOUT, telebot.apihelper.READ_TIMEOUT),
+                                                                 proxies=telebot.apihelper.proxy)
+        finally:
+            body.close()
+
+        return telebot.types.Message.de_json(telebot.apihelper._check_result(method_name, result)['result'])
+
+
+    def enable_profiling(self, sample_rate:float = 0.1, signal_path:str = None) -> None:
+        '''
+        Turn on the sampling profiler of handlers, triggers and requests to telegram. Can be called while the bot is running
+        ----------------------
+        sample_rate:float - the share of calls that are profiled, from 0 to 1
+        signal_path:str - if specified, the stacks are written to this file by the SIGUSR1 signal (kill -USR1 <pid>)
+        '''
+
+        if signal_path is not None and not self.profiler.install_signal(signal_path):
+            print('WARNING: The signal for the profiler can only be installed in the main thread and not on Windows')
+
+        self.profiler.enable(sample_rate)
+
+
+    def disable_profiling(self) -> None:
+        '''Turn off the profiler. The collected stacks remain'''
+
+        self.profiler.disable()
+
+
+    def dump_profile(self, path:str = None) -> str:
+        '''
+        Stacks collected by the profiler in the collapsed format (flamegraph.pl, speedscope)
+        ----------------------
+        path:str - if specified, the stacks are also written to this file
+        '''
 
+        if path is not None:
+            self.profiler.dump(path)
 
+        return self.profiler.collapsed()
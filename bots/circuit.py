@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+'''Module with a circuit breaker for requests to telegram: when telegram or the network fails, requests are paused instead of waiting for timeouts'''
+
+import time
+import random
+import threading as th
+from collections import deque
+from typing import Callable
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    '''The request was not sent because the circuit is open'''
+
+
+class CircuitBreaker:
+    '''
+    Watches the results of requests. If too many of the last requests failed or were too slow, the circuit opens:
+    requests are not sent for a pause that grows exponentially with each new opening (with random jitter, so that
+    many bots do not come back at the same moment). After the pause one probe request is let through (half-open):
+    its success closes the circuit, its failure opens it again.
+    ----------------------
+    methods:
+       acquire - May a request be sent now. Returns 0 or the number of seconds to wait
+       blocked - A request will not be sent now (without taking the probe)
+       record - Take into account the result of a request
+       release_probe - Give back the probe that was taken by a request that was not sent
+       call - Perform the function through the circuit
+       stats - State and counters
+    '''
+
+    def __init__(self, failure_rate:float = 0.5, window:int = 20, min_calls:int = 5, slow_call:float = 10.0,
+                 base_delay:float = 1.0, max_delay:float = 60.0, jitter:float = 0.5, is_failure:Callable = None):
+        '''
+        failure_rate:float - share of failed requests among the last ones at which the circuit opens
+        window:int - how many last requests are taken into account
+        min_calls:int - the circuit does not open until there are at least this number of requests in the window
+        slow_call:float - a request longer than this number of seconds is considered failed
+        base_delay:float - pause after the first opening, in seconds. Each next opening in a row doubles it
+        max_delay:float - maximum pause, in seconds
+        jitter:float - the pause is randomly reduced by up to this share
+        is_failure: function - which errors are failures of telegram or the network, function(error) -> bool. By default, network errors, answers 5xx and 429
+        '''
+
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.slow_call = slow_call
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.is_failure = is_failure or _is_failure
+
+        self.state = CLOSED
+        self._results = deque(maxlen=window) #True - failure
+        self._open_until = 0.0
+        self._openings_in_row = 0
+        self._probe = False
+        self._lock = th.Lock()
+        self._counts = {'calls': 0, 'failures': 0, 'slow': 0, 'rejected': 0, 'opened': 0}
+
+
+    def acquire(self) -> float:
+        '''May a request be sent now. Returns 0 if it may (in the half-open state this request becomes the probe), otherwise how many seconds to wait'''
+
+        with self._lock:
+            if self.state == CLOSED:
+                return 0.0
+
+            now = time.monotonic()
+            if self.state == OPEN and now >= self._open_until:
+                self.state = HALF_OPEN
+                self._probe = False
+
+            if self.state == HALF_OPEN and not self._probe:
+                self._probe = True
+                return 0.0
+
+            self._counts['rejected'] += 1
+            #While the probe is being performed, check again soon
+            return max(self._open_until - now, 0.1)
+
+
+    def blocked(self) -> bool:
+        '''A request will not be sent now: the pause is going on or the probe is being performed. Unlike acquire, does not take the probe'''
+
+        with self._lock:
+            if self.state == CLOSED:
+                return False
+            if self.state == OPEN:
+                return time.monotonic() < self._open_until
+            return self._probe
+
+
+    def release_probe(self) -> None:
+        '''Give back the probe taken by acquire if the request was not sent after all (for example, it was cancelled), so another request can be the probe'''
+
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probe = False
+
+
+    def record(self, failed:bool, seconds:float = 0.0) -> None:
+        '''
+        Take into account the result of a request
+        ----------------------
+        failed:bool - the request failed because of telegram or the network (see self.is_failure)
+        seconds:float - duration of the request. 0 - do not check for slowness (long polling)
+        '''
+
+        slow = seconds > self.slow_call
+        failed = failed or slow
+
+        with self._lock:
+            self._counts['calls'] += 1
+            self._counts['failures'] += failed
+            self._counts['slow'] += slow
+
+            if self.state == HALF_OPEN:
+                self._probe = False
+                if failed:
+                    self._open()
+                else:
+                    self.state = CLOSED
+                    self._openings_in_row = 0
+                    self._results.clear()
+                return
+
+            if self.state == OPEN:
+                #Result of a request that was sent before the opening
+                return
+
+            self._results.append(failed)
+            if len(self._results) >= self.min_calls and sum(self._results) >= self.failure_rate * len(self._results):
+                self._open()
+
+
+    def call(self, func, *args, **kwargs):
+        '''Perform the function through the circuit. If the circuit is open, CircuitOpenError is raised without a request'''
+
+        wait = self.acquire()
+        if wait:
+            raise CircuitOpenError(f'Telegram is unavailable, the next attempt in {wait:.1f} s')
+
+        start = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as err:
+            self.record(self.is_failure(err), time.monotonic() - start)
+            raise
+
+        self.record(False, time.monotonic() - start)
+        return result
+
+
+    def stats(self) -> dict:
+        '''State and counters: calls, failures, slow, rejected (attempts that were held back), opened, retry_in (seconds until the probe)'''
+
+        with self._lock:
+            stats = dict(self._counts)
+            stats['state'] = self.state
+            stats['retry_in'] = max(self._open_until - time.monotonic(), 0.0) if self.state == OPEN else 0.0
+
+        return stats
+
+
+    def _open(self) -> None:
+        '''Opens the circuit for a pause with exponential growth and jitter'''
+
+        delay = min(self.max_delay, self.base_delay * 2 ** min(self._openings_in_row, 30))
+        delay *= 1 - random.uniform(0, self.jitter)
+
+        self.state = OPEN
+        self._open_until = time.monotonic() + delay
+        self._openings_in_row += 1
+        self._counts['opened'] += 1
+        self._results.clear()
+
+
+def _is_failure(error:Exception) -> bool:
+    '''
+    The error says that telegram or the network is not working: network errors, answers 5xx and too many requests (429).
+    Answers like "chat not found" (400, 403) are errors of the request, telegram itself works
+    '''
+
+    code = getattr(error, 'error_code', None) or getattr(getattr(error, 'result', None), 'status_code', None)
+    if code is not None:
+        return code == 429 or code >= 500
+
+    #requests.ConnectionError, Timeout and socket errors are OSError
+    return isinstance(error, OSError)
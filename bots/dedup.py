@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+'''Module with a set of already sent messages, so that retries and restarts do not send the same message twice'''
+
+import sys
+import time
+import socket
+import sqlite3
+import hashlib
+import threading as th
+from collections import OrderedDict
+from typing import List
+
+
+def make_key(*parts) -> str:
+    '''Idempotency key: hash of the parts, for example (chat_id, text, event)'''
+
+    return hashlib.sha256('\x1f'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def not_delivered(error:Exception) -> bool:
+    '''
+    The error proves that telegram did not accept the message, so the key may be released and the message sent again:
+    an answer 4xx (including 429) or a failure to connect. After a read timeout or a dropped connection the message
+    may have been delivered already, so the key is kept
+    '''
+
+    code = getattr(error, 'error_code', None)
+    if code is not None:
+        return 400 <= code < 500
+
+    #NotifyApi (urllib): the address was not resolved or the connection was refused
+    reason = getattr(error, 'reason', error)
+    if isinstance(reason, (ConnectionRefusedError, socket.gaierror)):
+        return True
+
+    #telebot (requests). requests is not imported here if the bot does not use it
+    requests = sys.modules.get('requests')
+    if requests is not None and isinstance(error, requests.ConnectionError):
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+
+        import urllib3
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+    return False
+
+
+class DedupStore:
+    '''
+    Set of idempotency keys with a lifetime and a size limit, saved in SQLite between restarts.
+    The key is reserved before sending and released if the sending failed, so a message is sent at most once,
+    and a retry after an error is still possible.
+    ----------------------
+    methods:
+       reserve - Reserves the key. Returns False if it is already there (duplicate)
+       reserve_many - Reserves several keys with one write to the database
+       release - Releases the key after a failed sending
+    '''
+
+    def __init__(self, path:str = None, ttl:float = 7 * 24 * 3600, max_size:int = 100000):
+        '''
+        path:str - SQLite database where the keys are saved. None - only in memory
+        ttl:float - how many seconds the key is stored
+        max_size:int - maximum number of keys, the oldest ones are deleted
+        '''
+
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.stats = {'sent': 0, 'suppressed': 0, 'released': 0}
+
+        self._keys = OrderedDict() #key -> expiration time, in the order of adding
+        self._lock = th.Lock()
+        self._connect = None
+
+        if path is not None:
+            self._connect = sqlite3.connect(path, check_same_thread=False)
+            self._connect.execute('CREATE TABLE IF NOT EXISTS sent_keys (key TEXT PRIMARY KEY NOT NULL, expires REAL NOT NULL)')
+            self._connect.execute('DELETE FROM sent_keys WHERE expires < ?', (time.time(),))
+            self._connect.commit()
+
+            rows = self._connect.execute('SELECT key, expires FROM sent_keys ORDER BY expires DESC LIMIT ?', (max_size,)).fetchall()
+            for key, expires in reversed(rows):
+                self._keys[key] = expires
+
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+    def __contains__(self, key:str) -> bool:
+        with self._lock:
+            expires = self._keys.get(key)
+            return expires is not None and expires >= time.time()
+
+
+    def reserve(self, key:str) -> bool:
+        '''Reserves the key. Returns False if it is already there: the message has been sent and must not be sent again'''
+
+        return self.reserve_many([key])[0]
+
+
+    def reserve_many(self, keys:List[str]) -> List[bool]:
+        '''
+        Reserves several keys, for example of one message to a list of chats, with one commit of the database
+        instead of a commit per key. Returns for each key whether it was reserved (False - duplicate)
+        '''
+
+        now = time.time()
+        reserved = []
+        result = []
+
+        with self._lock:
+            for key in keys:
+                expires = self._keys.get(key)
+                if expires is not None and expires >= now:
+                    self.stats['suppressed'] += 1
+                    result.append(False)
+                    continue
+
+                self._keys[key] = now + self.ttl
+                self._keys.move_to_end(key)
+                self.stats['sent'] += 1
+                reserved.append((key, now + self.ttl))
+                result.append(True)
+
+            removed = self._trim(now)
+
+            if self._connect is not None and (reserved or removed):
+                self._connect.executemany('INSERT OR REPLACE INTO sent_keys VALUES (?, ?)', reserved)
+                if removed:
+                    self._connect.executemany('DELETE FROM sent_keys WHERE key = ?', [(old,) for old in removed])
+                self._connect.commit()
+
+        return result
+
+
+    def release(self, key:str) -> None:
+        '''Releases the key after a failed sending, so that a retry is possible'''
+
+        with self._lock:
+            if self._keys.pop(key, None) is None:
+                return
+
+            self.stats['sent'] -= 1
+            self.stats['released'] += 1
+
+            if self._connect is not None:
+                self._connect.execute('DELETE FROM sent_keys WHERE key = ?', (key,))
+                self._connect.commit()
+
+
+    def _trim(self, now:float) -> list:
+        '''Deletes expired keys and keys over the limit. Returns the deleted keys'''
+
+        removed = []
+
+        while self._keys:
+            key, expires = next(iter(self._keys.items()))
+            if expires >= now and len(self._keys) <= self.max_size:
+                break
+
+            self._keys.popitem(last=False)
+            removed.append(key)
+
+        return removed
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+'''Module with an immutable table of bot answers that can be replaced while the bot is running'''
+
+import csv
+import sqlite3
+from types import MappingProxyType
+from typing import Dict, Iterable, Tuple
+
+
+class DialogTable:
+    '''
+    Prebuilt read-only table of answers. Any change creates a new table, the old one is never modified,
+    so the bot can replace the table with one assignment while handlers are reading it.
+    ----------------------
+    methods:
+       find - Find the answer to the user's message
+       updated - Returns a new table with an added or replaced answer
+       without - Returns a new table without the answer
+       from_rows - Build a table from rows (answer_id, phrases, answer, consider_case)
+       from_file - Build a table from a csv file
+       from_sqlite - Build a table from a SQLite database
+    '''
+
+    __slots__ = ('remarks', '_exact', '_lower', '_orders', '_next', '_shared')
+
+    def __init__(self, remarks:Dict[str, dict] = None):
+        '''
+        remarks: dict - {answer_id: {'phrases': [...], 'answer': str, 'edit_case': bool}}.
+           If edit_case is True, the phrases must already be in lower case
+        '''
+
+        if remarks is None:
+            remarks = {}
+
+        self.remarks = MappingProxyType(dict(remarks))
+
+        #phrase -> (order of the answer, answer). The earlier answer wins, as when searching through the list
+        exact = {}
+        lower = {}
+        #Phrases of several answers: only they need a search of the next answer when the winning one is removed
+        shared = set()
+
+        for order, remark in enumerate(self.remarks.values()):
+            target = lower if remark['edit_case'] else exact
+            value = (order, remark['answer'])
+
+            for phrase in remark['phrases']:
+                if phrase not in target:
+                    target[phrase] = value
+                else:
+                    shared.add(phrase)
+
+        self._exact = exact
+        self._lower = lower
+        self._orders = {answer_id: order for order, answer_id in enumerate(self.remarks)}
+        self._next = len(self._orders)
+        self._shared = shared
+
+
+    def __len__(self) -> int:
+        return len(self.remarks)
+
+
+    def __iter__(self):
+        return iter(self.remarks)
+
+
+    def __getitem__(self, answer_id:str) -> dict:
+        return self.remarks[answer_id]
+
+
+    def find(self, msg:str, default:str = None) -> str:
+        '''
+        Find the answer to the user's message
+        ----------------------
+        msg: str - the user's message
+        default: str - what to return if there is no answer
+        '''
+
+        exact = self._exact.get(msg)
+        lower = self._lower.get(msg.lower()) if self._lower else None
+
+        if exact is None and lower is None:
+            return default
+
+        if exact is None or (lower is not None and lower[0] < exact[0]):
+            return lower[1]
+
+        return exact[1]
+
+
+    def updated(self, answer_id:str, remark:dict) -> 'DialogTable':
+        '''Returns a new table with an added or replaced answer'''
+
+        remarks = self.remarks.copy()
+        remarks[answer_id] = remark
+
+        return self._patched(remarks, answer_id, remark)
+
+
+    def without(self, answer_id:str) -> 'DialogTable':
+        '''Returns a new table without the answer'''
+
+        if answer_id not in self.remarks:
+            return self
+
+        remarks = self.remarks.copy()
+        del remarks[answer_id]
+
+        return self._patched(remarks, answer_id, None)
+
+
+    def _patched(self, remarks:dict, answer_id:str, remark:dict) -> 'DialogTable':
+        '''
+        New table in which only the phrases of one answer are changed: the indexes are copied, not rebuilt from all answers
+        ----------------------
+        remarks: dict - answers of the new table
+        answer_id: str - the changed answer
+        remark: dict - its new value. None - the answer is removed
+        '''
+
+        table = DialogTable.__new__(DialogTable)
+        table.remarks = MappingProxyType(remarks)
+        table._exact = exact = dict(self._exact)
+        table._lower = lower = dict(self._lower)
+        table._orders = orders = dict(self._orders)
+        table._shared = shared = set(self._shared)
+
+        #A replaced answer keeps its place, a new one goes to the end
+        order = orders.get(answer_id, self._next)
+        old = self.remarks.get(answer_id)
+
+        if old is not None:
+            target = lower if old['edit_case'] else exact
+
+            for phrase in old['phrases']:
+                if target.get(phrase, (None,))[0] != order:
+                    continue
+
+                del target[phrase]
+                if phrase not in shared:
+                    continue
+
+                #The phrase passes to the next answer that has it
+                for other_id, other in remarks.items():
+                    if other_id != answer_id and other['edit_case'] == old['edit_case'] and phrase in other['phrases']:
+                        target[phrase] = (orders[other_id], other['answer'])
+                        break
+
+        if remark is None:
+            del orders[answer_id]
+        else:
+            orders[answer_id] = order
+            target = lower if remark['edit_case'] else exact
+            value = (order, remark['answer'])
+
+            for phrase in remark['phrases']:
+                current = target.get(phrase)
+                if current is None:
+                    target[phrase] = value
+                    continue
+
+                shared.add(phrase)
+                if current[0] > order:
+                    target[phrase] = value
+
+        table._next = max(self._next, order + 1)
+        return table
+
+
+    @classmethod
+    def from_rows(cls, rows:Iterable[Tuple], separator:str = '|') -> 'DialogTable':
+        '''
+        Build a table from rows
+        ----------------------
+        rows: iterable - rows like (answer_id, phrases, answer, consider_case). answer_id can be empty, then the row number is used.
+           phrases is a string with phrases separated by separator or a list of phrases. consider_case is optional
+        separator: str - phrase separator
+        '''
+
+        remarks = {}
+        answers = {} #The same answer texts are stored once
+
+        for i, row in enumerate(rows):
+            if len(row) < 3:
+                continue
+
+            answer_id, phrases, answer = row[0], row[1], row[2]
+            consider_case = len(row) > 3 and _to_bool(row[3])
+
+            if not answer_id:
+                answer_id = 'row-id=' + str(i)
+
+            if isinstance(phrases, str):
+                phrases = phrases.split(separator)
+
+            if consider_case:
+                phrases = [phrase.strip() for phrase in phrases]
+            else:
+                phrases = [phrase.strip().lower() for phrase in phrases]
+
+            remarks[str(answer_id)] = {
+                'phrases': phrases,
+                'answer': answers.setdefault(answer, answer),
+                'edit_case': not consider_case
+            }
+
+        return cls(remarks)
+
+
+    @classmethod
+    def from_file(cls, path:str, separator:str = '|', delimiter:str = ',') -> 'DialogTable':
+        '''
+        Build a table from a csv file. Each line: answer_id,phrase 1|phrase 2,answer[,consider_case]
+        ----------------------
+        path: str - path to the file
+        separator: str - phrase separator
+        delimiter: str - column separator
+        '''
+
+        with open(path, 'r', encoding='utf-8', newline='') as file:
+            return cls.from_rows(csv.reader(file, delimiter=delimiter), separator)
+
+
+    @classmethod
+    def from_sqlite(cls, path:str, table:str = 'answers', separator:str = '|') -> 'DialogTable':
+        '''
+        Build a table from a SQLite database
+        ----------------------
+        path: str - path to the database
+        table: str - table with the columns answer_id, phrases, answer, consider_case
+        separator: str - phrase separator
+        '''
+
+        connect = sqlite3.connect(path)
+        try:
+            cursor = connect.execute(f'SELECT answer_id, phrases, answer, consider_case FROM "{table}"')
+            return cls.from_rows(cursor, separator)
+        finally:
+            connect.close()
+
+
+def _to_bool(value) -> bool:
+    '''Converts a value from a file or database to bool'''
+
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes')
+
+    return bool(value)
@@ -6,6 +6,8 @@ import sys
 import time
 import random
 import basic_bot
+import threading as th
+import dialog_table
 from typing import List
 from dotenv import load_dotenv, find_dotenv
 
@@ -17,13 +19,14 @@ class NotificationsBot(basic_bot.TelegramBotParent):
     We will receive a notification when someone changes our file. (Can be used to check the database for changes)
     '''
 
-    def __init__(self, token:str, users:List[str]):
+    def __init__(self, token:str, users:List[str], dedup_file:str = 'notifications.sqlite'):
         '''
         token:str - bot token received from https://t.me/BotFather
         userslist[str] - users tokens received from https://t.me/getmyid_bot
+        dedup_file:str - where the sent notifications are remembered, so that after a restart the same change is not reported again
         '''
 
-        super().__init__(token)
+        super().__init__(token, dedup_file=dedup_file)
         self.users = users
 
         self.last_changes = {}
@@ -45,8 +48,7 @@ class NotificationsBot(basic_bot.TelegramBotParent):
                 msg = f'😱 Someone deleted or rename your file "{filename}"!'
                 self.last_changes.pop(filename)
 
-            for user in self.users:
-                self.api.send_message(user, msg)
+            self.send(msg, self.users)
 
             return 1
 
@@ -56,8 +58,7 @@ class NotificationsBot(basic_bot.TelegramBotParent):
             text_time = time.ctime(self.last_changes[filename])
             msg = f'Starting to monitor the file "{filename}". Last updated {text_time}.'
 
-            for user in self.users:
-                self.api.send_message(user, msg)
+            self.send(msg, self.users)
 
         else:
             change = os.path.getmtime(filename)
@@ -68,8 +69,8 @@ class NotificationsBot(basic_bot.TelegramBotParent):
                 text_time = time.ctime(self.last_changes[filename])
                 msg = f'❗️Viu-viu! {text_time} someone touched your file {filename}!❗️'
 
-                for user in self.users:
-                    self.api.send_message(user, msg)
+                #The same change is reported only once, even if the check is repeated after an error
+                self.send(msg, self.users, event=f'{filename}:{change}')
 
         return 0
 
@@ -86,12 +87,14 @@ class ListenerBot(basic_bot.TelegramBotParent):
         '''
 
         super().__init__(token, 'Markdown')
-        self.add_listening(self._create_answers)
+        self.add_listening(self._create_answers, lite=True)
 
-        self.dialog = {}
+        #The table is never changed, it is replaced by a new one. Only writers take the lock
+        self.dialog = dialog_table.DialogTable()
         self.default_answer = 'This command is not available'
 
         self._last_id = 0
+        self._dialog_lock = th.Lock()
 
 
     def start(self) -> None:
@@ -109,10 +112,6 @@ class ListenerBot(basic_bot.TelegramBotParent):
         consider_case: bool - Do need to be case-sensitive
         '''
 
-        if answer_id is None:
-            answer_id = 'self-id=' + str(self._last_id)
-            self._last_id += 1
-
         if not consider_case:
             phrases_case = phrases
             phrases = []
@@ -126,28 +125,45 @@ class ListenerBot(basic_bot.TelegramBotParent):
             'edit_case': not consider_case
         }
 
-        self.dialog[answer_id] = remark
+        with self._dialog_lock:
+            if answer_id is None:
+                answer_id = 'self-id=' + str(self._last_id)
+                self._last_id += 1
 
+            self.dialog = self.dialog.updated(answer_id, remark)
 
-    def _create_answers(self, message) -> None:
-        '''We respond to the user's message if it is in the dialog list, otherwise we respond with a standard message'''
 
-        msg = message.text.strip()
+    def remove_answers(self, answer_id:str) -> None:
+        '''Removes the answer by its id'''
 
-        for answer_id in self.dialog:
-            remark = self.dialog[answer_id]
+        with self._dialog_lock:
+            self.dialog = self.dialog.without(answer_id)
 
-            if remark['edit_case']:
-                msg = msg.lower()
 
+    def load_answers(self, path:str, table:str = None) -> None:
+        '''
+        Replaces all answers with answers from a file or database. The new table is built aside, and then replaced in one step
+        ----------------------
+        path: str - csv file (answer_id,phrase 1|phrase 2,answer[,consider_case]) or SQLite database
+        table: str - the table in the database with the columns answer_id, phrases, answer, consider_case. If specified, the path is opened as a database
+        '''
 
-            if msg in remark['phrases']:
-                answer = remark['answer']
-                break
+        if table is None:
+            new_dialog = dialog_table.DialogTable.from_file(path)
         else:
-            answer = self.default_answer
+            new_dialog = dialog_table.DialogTable.from_sqlite(path, table)
 
-        self.api.send_message(message.from_user.id, answer)
+        with self._dialog_lock:
+            self.dialog = new_dialog
+
+
+    def _create_answers(self, message) -> None:
+        '''We respond to the user's message if it is in the dialog list, otherwise we respond with a standard message'''
+
+        msg = message.text.strip()
+        answer = self.dialog.find(msg, self.default_answer)
+
+        self.reply(answer, message.from_user.id)
 
 
 
@@ -187,21 +203,9 @@ class BotWithKeyboard(ListenerBot):
         '''We respond to the user's message if it is in the dialog list, otherwise we respond with a standard message'''
 
         msg = message.text.strip()
+        answer = self.dialog.find(msg, self.default_answer)
 
-        for answer_id in self.dialog:
-            remark = self.dialog[answer_id]
-
-            if remark['edit_case']:
-                msg = msg.lower()
-
-
-            if msg in remark['phrases']:
-                answer = remark['answer']
-                break
-        else:
-            answer = self.default_answer
-
-        self.api.send_message(message.from_user.id, answer, reply_markup=self.default_keyboard)
+        self.reply(answer, message.from_user.id, self.default_keyboard)
 
 
     def _process_keyboard(self, click) -> None:
@@ -216,14 +220,14 @@ class BotWithKeyboard(ListenerBot):
                 if callable(action[0]):
                     result = action[0]()
                     if isinstance(result, str):
-                        self.api.send_message(user_id, result, reply_markup=action[1])
-                        self.api.edit_message_reply_markup(chat_id=user_id, message_id=click.message.id, reply_markup=None)
+                        self.reply(result, user_id, action[1])
+                        self.api_call(self.api.edit_message_reply_markup, chat_id=user_id, message_id=click.message.id, reply_markup=None)
                     else:
-                        self.api.edit_message_reply_markup(chat_id=user_id, message_id=click.message.id, reply_markup=action[1])
+                        self.api_call(self.api.edit_message_reply_markup, chat_id=user_id, message_id=click.message.id, reply_markup=action[1])
 
                 else:
-                    self.api.send_message(user_id, action[0], reply_markup=action[1])
-                    self.api.edit_message_reply_markup(chat_id=user_id, message_id=click.message.id, reply_markup=None)
+                    self.reply(action[0], user_id, action[1])
+                    self.api_call(self.api.edit_message_reply_markup, chat_id=user_id, message_id=click.message.id, reply_markup=None)
 
 
 def test1(token:str) -> None:
@@ -232,12 +236,12 @@ def test1(token:str) -> None:
     users = ['571315321'] #usersID
     telegram = NotificationsBot(token, users)
 
-    while True:
-        status_code = telegram.start('data.txt')
-        if status_code:
-            print(f'The test is over with the status code {status_code}')
-            break
-        time.sleep(1)
+    #The check is launched every second by the bot scheduler, it stops when start returns a non-zero status code
+    telegram.add_trigger(telegram.start, interval=1, args=['data.txt'], stop_on_result=True, run_now=True)
+    telegram.start_triggers(separate_thread=False)
+
+    status_code = telegram.trigger_stats()['start']['last_result']
+    print(f'The test is over with the status code {status_code}')
 
 
 def test2(token:str) -> None:
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+'''Module with thin views over the raw updates of telegram: nested objects are created only when they are accessed'''
+
+from typing import Callable, List
+
+
+#Message fields that determine its type, in the same order as telebot checks them
+CONTENT_TYPES = ('text', 'audio', 'document', 'animation', 'game', 'photo', 'sticker', 'video', 'video_note', 'voice', 'contact',
+                 'location', 'venue', 'dice', 'new_chat_members', 'left_chat_member', 'new_chat_title', 'new_chat_photo',
+                 'delete_chat_photo', 'group_chat_created', 'supergroup_chat_created', 'channel_chat_created', 'migrate_to_chat_id',
+                 'migrate_from_chat_id', 'pinned_message', 'invoice', 'successful_payment', 'connected_website', 'poll',
+                 'passport_data', 'proximity_alert_triggered', 'video_chat_scheduled', 'video_chat_started', 'video_chat_ended',
+                 'video_chat_participants_invited', 'web_app_data', 'message_auto_delete_timer_changed', 'forum_topic_created',
+                 'forum_topic_closed', 'forum_topic_reopened', 'user_shared', 'chat_shared', 'story')
+
+#Names that differ in telebot and in the telegram json
+_RENAMED = {'from_user': 'from', 'id': 'message_id'}
+
+
+class LiteObject:
+    '''
+    Read-only view of a json object of telegram. Fields are read as attributes, nested objects are wrapped on access.
+    Missing fields are None, as in telebot objects.
+    '''
+
+    __slots__ = ('_data', '_cache')
+
+    def __init__(self, data:dict):
+        self._data = data
+        self._cache = None
+
+
+    def __getattr__(self, name:str):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        cache = self._cache
+        if cache is not None and name in cache:
+            return cache[name]
+
+        data = self._data
+        key = name if name in data else _RENAMED.get(name, name)
+        value = data.get(key)
+
+        if isinstance(value, dict):
+            value = LiteObject(value)
+        elif isinstance(value, list) and value and isinstance(value[0], dict):
+            value = [LiteObject(item) for item in value]
+        else:
+            return value
+
+        if cache is None:
+            cache = self._cache = {}
+        cache[name] = value
+
+        return value
+
+
+    @property
+    def json(self) -> dict:
+        '''The raw json of the object'''
+
+        return self._data
+
+
+class LiteMessage(LiteObject):
+    '''Message view. In addition to the fields of the json, it has content_type like telebot.types.Message'''
+
+    __slots__ = ()
+
+    @property
+    def content_type(self) -> str:
+        '''Message type: text, photo, document...'''
+
+        data = self._data
+        for content_type in CONTENT_TYPES:
+            if content_type in data:
+                return content_type
+
+        return None
+
+
+    def full(self):
+        '''Creates the full telebot.types.Message, if the handler needs it after all'''
+
+        import telebot
+        return telebot.types.Message.de_json(self._data)
+
+
+class LiteUpdate:
+    '''An update with a message that will be processed by lite handlers without full parsing'''
+
+    __slots__ = ('update_id', 'message', 'handler')
+
+    def __init__(self, update_id:int, message:LiteMessage, handler:Callable):
+        self.update_id = update_id
+        self.message = message
+        self.handler = handler
+
+
+    def __getattr__(self, name:str):
+        #The other types of updates are absent in this update
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        return None
+
+
+class LiteHandlers:
+    '''
+    Message handlers that receive LiteMessage instead of telebot.types.Message
+    ----------------------
+    methods:
+       add - Add a handler
+       match - Returns the handler for the raw message or None
+    '''
+
+    def __init__(self):
+        self.handlers = []
+
+
+    def __bool__(self) -> bool:
+        return bool(self.handlers)
+
+
+    def add(self, handler:Callable, content_types:List[str], commands:List[str] = None, func:Callable = None) -> None:
+        '''Add a handler. Parameters as in TelegramBotParent.add_listening'''
+
+        self.handlers.append((handler, set(content_types), set(commands) if commands else None, func))
+
+
+    def match(self, message:LiteMessage) -> Callable:
+        '''Returns the first handler that fits the message, or None'''
+
+        content_type = message.content_type
+
+        for handler, content_types, commands, func in self.handlers:
+            if content_type not in content_types:
+                continue
+
+            if commands is not None:
+                text = message.text
+                if not text or not text.startswith('/'):
+                    continue
+                if text.split()[0][1:].split('@')[0] not in commands:
+                    continue
+
+            if func is not None and not func(message):
+                continue
+
+            return handler
+
+        return None
+
+
+def parse_updates(json_updates:List[dict], handlers:LiteHandlers, de_json:Callable) -> list:
+    '''
+    Turns raw updates into objects: messages for lite handlers into LiteUpdate, the rest are fully parsed by de_json
+    ----------------------
+    json_updates: List[dict] - updates as telegram returned them
+    handlers: LiteHandlers - lite handlers
+    de_json: function - full parsing, telebot.types.Update.de_json
+    '''
+
+    result = []
+
+    for raw in json_updates:
+        message_json = raw.get('message')
+
+        if message_json is not None:
+            message = LiteMessage(message_json)
+            handler = handlers.match(message)
+            if handler is not None:
+                result.append(LiteUpdate(raw['update_id'], message, handler))
+                continue
+
+        result.append(de_json(raw))
+
+    return result
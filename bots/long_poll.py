@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+'''Module with adaptive settings of long polling: timeout, batch size and pause between requests follow the flow of updates'''
+
+
+class AdaptivePolling:
+    '''
+    Chooses the parameters of the next getUpdates by the previous ones:
+       - empty answers lengthen the timeout (fewer useless requests when nobody writes),
+       - full batches increase limit (there is a backlog, take more at once), small batches decrease it,
+       - with a steady flow, a short pause before the request collects several updates into one batch.
+    ----------------------
+    methods:
+       params - timeout and limit for the next request
+       observe - Take into account the result of a request
+       delay - Pause before the next request
+       stats - Statistics of polling, including round-trips per update
+    '''
+
+    def __init__(self, min_timeout:int = 1, max_timeout:int = 50, min_limit:int = 10, max_limit:int = 100, max_delay:float = 0.2,
+                 target_batch:int = 10, smoothing:float = 0.3):
+        '''
+        min_timeout, max_timeout:int - limits of the timeout of long polling, in seconds (telegram allows up to 50)
+        min_limit, max_limit:int - limits of the number of updates in one answer (telegram allows up to 100)
+        max_delay:float - maximum pause before the request to collect a batch, in seconds. 0 - answer as fast as possible
+        target_batch:int - how many updates the pause tries to collect
+        smoothing:float - weight of the last request in the estimate of the flow of updates, from 0 to 1
+        '''
+
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_delay = max_delay
+        self.target_batch = target_batch
+        self.smoothing = smoothing
+
+        self.timeout = min_timeout
+        self.limit = min_limit
+        self.rate = 0.0 #estimate of the flow, updates per second
+        self.last_full = False
+
+        self.polls = 0
+        self.empty_polls = 0
+        self.updates = 0
+
+
+    def params(self) -> tuple:
+        '''timeout and limit for the next request'''
+
+        return self.timeout, self.limit
+
+
+    def observe(self, count:int, seconds:float) -> None:
+        '''
+        Take into account the result of a request
+        ----------------------
+        count:int - how many updates were received
+        seconds:float - time since the previous answer
+        '''
+
+        self.polls += 1
+        self.updates += count
+
+        if seconds > 0:
+            self.rate += self.smoothing * (count / seconds - self.rate)
+
+        if count == 0:
+            self.empty_polls += 1
+            self.timeout = min(self.max_timeout, self.timeout * 2)
+        else:
+            self.timeout = max(self.min_timeout, self.timeout // 2)
+
+        self.last_full = count >= self.limit
+        if self.last_full:
+            self.limit = min(self.max_limit, self.limit * 2)
+        elif count < self.limit // 4:
+            self.limit = max(self.min_limit, self.limit // 2)
+
+
+    def delay(self) -> float:
+        '''Pause before the next request. There is no pause if there is a backlog or if not even one more update is expected during it'''
+
+        if self.last_full or self.rate * self.max_delay < 1:
+            return 0.0
+
+        return min(self.max_delay, (self.target_batch - 1) / self.rate)
+
+
+    def stats(self) -> dict:
+        '''Statistics of polling. round_trips_per_update - how many requests to telegram were spent on one update'''
+
+        return {
+            'polls': self.polls,
+            'empty_polls': self.empty_polls,
+            'updates': self.updates,
+            'round_trips_per_update': self.polls / self.updates if self.updates else None,
+            'timeout': self.timeout,
+            'limit': self.limit,
+            'rate': self.rate,
+        }
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+'''Module with a cache of file_id of files already uploaded to telegram and a streamed body for uploading files'''
+
+import io
+import os
+import json
+import uuid
+import hashlib
+import threading as th
+
+
+#The field of the message where telegram returns the sent file
+MEDIA_FIELDS = ('document', 'photo', 'video', 'audio', 'animation', 'voice', 'video_note', 'sticker')
+
+#Parts of the descriptions of telegram errors saying that the file_id itself is no longer valid
+FILE_ID_ERRORS = ('wrong file identifier', 'wrong remote file identifier', 'file reference', 'file_reference', 'wrong file_id',
+                  'file_id_invalid', 'wrong type of the web page content')
+
+
+def file_hash(path:str, chunk_size:int = 1024 * 1024) -> str:
+    '''Hash of the contents of the file. The file is read in chunks, not entirely'''
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def file_id_of(message, kind:str) -> str:
+    '''Returns the file_id of the file from the message that telegram returned after sending'''
+
+    media = getattr(message, kind, None)
+    if isinstance(media, list):
+        #Photos come in several sizes, the last one is the original
+        media = media[-1] if media else None
+
+    return getattr(media, 'file_id', None)
+
+
+def is_file_id_error(error:Exception) -> bool:
+    '''
+    The error of telegram says that the file_id is not valid. Other errors (the bot was blocked by the user, chat not found)
+    concern only one chat, and the file_id remains valid for the others
+    '''
+
+    description = str(getattr(error, 'description', None) or error).lower()
+    return getattr(error, 'error_code', 400) == 400 and any(text in description for text in FILE_ID_ERRORS)
+
+
+class FileIdCache:
+    '''
+    Remembers the file_id that telegram returned for the uploaded file, by the hash of its contents.
+    The same file is then sent to any chat by file_id without uploading again.
+    ----------------------
+    methods:
+       get - Returns the file_id of the file or None
+       put - Remembers the file_id of the file
+       forget - Forgets the file_id (for example, if telegram no longer accepts it)
+    '''
+
+    def __init__(self, path:str = None):
+        '''path:str - the file where the cache is saved. None - only in memory'''
+
+        self.path = path
+        self.stats = {'hits': 0, 'uploads': 0}
+
+        self._lock = th.Lock()
+        self._file_ids = {}  #'kind:hash' -> file_id
+        self._hashes = {}    #(path, size, mtime) -> hash, so as not to read unchanged files again
+
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as file:
+                    self._file_ids = json.load(file)
+            except (OSError, ValueError):
+                self._file_ids = {}
+
+
+    def _key(self, path:str, kind:str) -> str:
+        '''Cache key: the type of media and the hash of the contents'''
+
+        info = os.stat(path)
+        file_key = (os.path.abspath(path), info.st_size, info.st_mtime_ns)
+
+        content_hash = self._hashes.get(file_key)
+        if content_hash is None:
+            content_hash = file_hash(path)
+            self._hashes[file_key] = content_hash
+
+        return kind + ':' + content_hash
+
+
+    def get(self, path:str, kind:str) -> str:
+        '''Returns the file_id of the file or None if it has not been uploaded yet'''
+
+        key = self._key(path, kind)
+
+        with self._lock:
+            file_id = self._file_ids.get(key)
+            if file_id is not None:
+                self.stats['hits'] += 1
+
+        return file_id
+
+
+    def put(self, path:str, kind:str, file_id:str) -> None:
+        '''Remembers the file_id of the file'''
+
+        if file_id is None:
+            return
+
+        key = self._key(path, kind)
+
+        with self._lock:
+            self._file_ids[key] = file_id
+            self.stats['uploads'] += 1
+            self._save()
+
+
+    def forget(self, path:str, kind:str) -> None:
+        '''Forgets the file_id of the file'''
+
+        key = self._key(path, kind)
+
+        with self._lock:
+            if self._file_ids.pop(key, None) is not None:
+                self._save()
+
+
+    def _save(self) -> None:
+        '''Saves the cache to the file'''
+
+        if self.path is None:
+            return
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(self._file_ids, file)
+        os.replace(tmp_path, self.path)
+
+
+class MultipartStream:
+    '''
+    Body of a multipart/form-data request with one file. The file is read from the disk in chunks while the request is being sent,
+    and the length is known in advance, so requests sends it with Content-Length and without loading the file into memory
+    ----------------------
+    methods:
+       read - Next bytes of the body
+       close - Closes the file
+    '''
+
+    def __init__(self, fields:dict, name:str, path:str, chunk_size:int = 64 * 1024):
+        '''
+        fields:dict - the other parameters of the request, their values are converted to str. None values are skipped
+        name:str - name of the field with the file, for example document
+        path:str - path to the file
+        chunk_size:int - how many bytes are read at a time when the body is iterated
+        '''
+
+        boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary=' + boundary
+        self.chunk_size = chunk_size
+
+        head = b''
+        for key, value in fields.items():
+            if value is not None:
+                head += f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'.encode('utf-8')
+
+        filename = os.path.basename(path).replace('"', '%22')
+        head += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n').encode('utf-8')
+        tail = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+        self._file = open(path, 'rb')
+        self._length = len(head) + os.fstat(self._file.fileno()).st_size + len(tail)
+        self._parts = [io.BytesIO(head), self._file, io.BytesIO(tail)]
+
+
+    def __len__(self) -> int:
+        return self._length
+
+
+    def __iter__(self):
+        return iter(lambda: self.read(self.chunk_size), b'')
+
+
+    def read(self, size:int = -1) -> bytes:
+        '''Next bytes of the body. size < 0 - everything that is left'''
+
+        result = b''
+
+        while self._parts and (size < 0 or len(result) < size):
+            chunk = self._parts[0].read(-1 if size < 0 else size - len(result))
+            if chunk:
+                result += chunk
+            else:
+                self._parts.pop(0)
+
+        return result
+
+
+    def close(self) -> None:
+        '''Closes the file'''
+
+        self._file.close()
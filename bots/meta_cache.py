@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+'''Module with a read-through cache of rarely changing data of telegram: get_me, get_chat, get_chat_member'''
+
+import time
+import threading as th
+from collections import OrderedDict
+from typing import Callable
+
+
+#How many seconds the answer of each method is stored
+TTLS = {
+    'get_me': 3600.0,
+    'get_chat': 300.0,
+    'get_chat_member': 60.0,
+}
+
+
+class _Flight:
+    '''A request that is being performed: the other threads with the same key wait for its result'''
+
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = th.Event()
+        self.value = None
+        self.error = None
+
+
+class MetaCache:
+    '''
+    Read-through cache with a lifetime for each method. Errors like "chat not found" are also stored (negative caching),
+    so that a wrong id does not cause a request on each message. If several threads miss the same key at once,
+    only one request is made, and the others wait for its result (single-flight).
+    ----------------------
+    methods:
+       get - Value from the cache, or from load() if it is not there
+       invalidate - Forget the values of the method (or one value)
+       stats - Statistics of hits and misses
+    '''
+
+    def __init__(self, ttls:dict = None, negative_ttl:float = 30.0, max_size:int = 10000, is_negative:Callable = None):
+        '''
+        ttls:dict - method -> lifetime in seconds, as in TTLS. Methods that are not there are stored for 60 seconds
+        negative_ttl:float - how many seconds the error is stored
+        max_size:int - maximum number of values, the least recently used ones are deleted
+        is_negative: function - which errors are stored, function(error) -> bool. By default, errors of telegram 400 and 403
+           (not found, no access), and not network errors
+        '''
+
+        self.ttls = dict(TTLS, **(ttls or {}))
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.is_negative = is_negative or _is_negative
+
+        self._values = OrderedDict() #(method, key) -> (expiration time, value, error)
+        self._flights = {}
+        self._lock = th.Lock()
+        self._counts = {'hits': 0, 'negative_hits': 0, 'misses': 0, 'shared': 0}
+
+
+    def get(self, method:str, key, load:Callable):
+        '''
+        Value from the cache, or from load() if it is not there or it is outdated. The stored error is raised again
+        ----------------------
+        method:str - name of the method, determines the lifetime
+        key: - arguments of the method, for example (chat_id, user_id)
+        load: function - performs the request, load() -> value
+        '''
+
+        cache_key = (method, key)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._values.get(cache_key)
+            if entry is not None and entry[0] > now:
+                self._values.move_to_end(cache_key)
+                if entry[2] is not None:
+                    self._counts['negative_hits'] += 1
+                    raise _fresh(entry[2])
+
+                self._counts['hits'] += 1
+                return entry[1]
+
+            flight = self._flights.get(cache_key)
+            owner = flight is None
+            if owner:
+                flight = self._flights[cache_key] = _Flight()
+                self._counts['misses'] += 1
+            else:
+                self._counts['shared'] += 1
+
+        if not owner:
+            flight.done.wait()
+            if flight.error is not None:
+                raise _fresh(flight.error)
+            return flight.value
+
+        try:
+            flight.value = load()
+        except Exception as err:
+            flight.error = err
+
+        with self._lock:
+            if flight.error is None:
+                self._store(cache_key, (time.monotonic() + self.ttls.get(method, 60.0), flight.value, None))
+            elif self.is_negative(flight.error):
+                self._store(cache_key, (time.monotonic() + self.negative_ttl, None, flight.error))
+
+            self._flights.pop(cache_key, None)
+
+        flight.done.set()
+
+        if flight.error is not None:
+            raise _fresh(flight.error)
+        return flight.value
+
+
+    def invalidate(self, method:str = None, key = None) -> None:
+        '''
+        Forget the values
+        ----------------------
+        method:str - forget only the values of this method. None - everything
+        key: - forget only this value of the method
+        '''
+
+        with self._lock:
+            if method is None:
+                self._values.clear()
+            elif key is not None:
+                self._values.pop((method, key), None)
+            else:
+                for cache_key in [cache_key for cache_key in self._values if cache_key[0] == method]:
+                    del self._values[cache_key]
+
+
+    def stats(self) -> dict:
+        '''Statistics: hits, negative_hits (stored errors), misses (requests), shared (waited for the request of another thread), hit_rate, size'''
+
+        with self._lock:
+            stats = dict(self._counts)
+            stats['size'] = len(self._values)
+
+        total = stats['hits'] + stats['negative_hits'] + stats['misses'] + stats['shared']
+        stats['hit_rate'] = (total - stats['misses']) / total if total else 0.0
+
+        return stats
+
+
+    def _store(self, cache_key:tuple, entry:tuple) -> None:
+        '''Saves the value and deletes the least recently used ones over the limit'''
+
+        self._values[cache_key] = entry
+        self._values.move_to_end(cache_key)
+
+        while len(self._values) > self.max_size:
+            self._values.popitem(last=False)
+
+
+def _is_negative(error:Exception) -> bool:
+    '''Telegram answered that there is no such chat or user or no access: the answer will not change soon'''
+
+    return getattr(error, 'error_code', None) in (400, 403)
+
+
+def _fresh(error:Exception) -> Exception:
+    '''
+    A copy of the stored error without a traceback: raising the same object again and again would lengthen its traceback with each raise.
+    __init__ is not called, because errors of telegram take other parameters than their args
+    '''
+
+    cls = type(error)
+    fresh = cls.__new__(cls)
+    fresh.__dict__.update(error.__dict__)
+    fresh.args = error.args
+
+    return fresh
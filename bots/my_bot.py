@@ -14,7 +14,7 @@ class NotificationsBot(basic_bot.TelegramBotParent):
     We will receive a notification when someone changes our file. (Can be used to check the database for changes)
     '''
 
-    def __init__(self, token, token, users):
+    def __init__(self, token, users):
         '''
         token:str - bot token received from https://t.me/BotFather
         userslist[str] - users tokens received from https://t.me/getmyid_bot
@@ -67,14 +67,19 @@ class NotificationsBot(basic_bot.TelegramBotParent):
         return 0
         
 
+    def start_notifications(self, separate_thread = True):
+        '''Starts notificationTrigger on the scheduler of the bot, all triggers work in one thread'''
+        
+        self.add_trigger(self.notificationTrigger, interval = 1, args = ['data.txt'], stop_on_result = True, run_now = True)
+        self.start_triggers(separate_thread)
+
+
 if __name__ == '__main__':
     token = 'TOKEN'
     users = ['571315321'] #usersID
     telegram = NotificationsBot(token, users)
-    while True:
-        status_code = telegram.notificationTrigger('data.txt')
-        if status_code:
-            print(f'The test is over with the status code {status_code}')
-            break
-        time.sleep(1)
+    telegram.start_notifications(separate_thread=False)
+
+    status_code = telegram.trigger_stats()['notificationTrigger']['last_result']
+    print(f'The test is over with the status code {status_code}')
 
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+'''
+Module with a minimal client that can only send messages. It does not import telebot and requests,
+so short scripts (for example, notifications by cron) that send a message and exit start several times faster.
+'''
+
+import json
+
+
+API_URL = 'https://api.telegram.org/bot{token}/{method}'
+
+
+class TelegramError(RuntimeError):
+    '''
+    Telegram answered with an error. Like ApiTelegramException of telebot, it has error_code, so the circuit breaker
+    and the cache of metadata can tell errors of telegram (5xx, 429) from errors of the request (400, 403)
+    '''
+
+    def __init__(self, method:str, error_code:int, description:str):
+        super().__init__(f'Telegram error in {method}: [{error_code}] {description}')
+        self.error_code = error_code
+        self.description = description
+
+
+class NotifyApi:
+    '''
+    Send-only replacement of telebot.TeleBot: the methods have the same names and parameters as in telebot,
+    so the code of the bot (self.api.send_message(...)) does not change
+    ----------------------
+    methods:
+       call - Call any method of the telegram api
+       send_message - Sending a message
+    '''
+
+    def __init__(self, token:str, parse_mode:str = None, timeout:float = 10.0):
+        '''
+        token:str - bot token received from https://t.me/BotFather
+        parse_mode: str/None - how to format text, HTML or MARKDOWN (None = usual text)
+        timeout:float - how many seconds to wait for the answer of telegram
+        '''
+
+        self.token = token
+        self.parse_mode = parse_mode
+        self.timeout = timeout
+
+
+    def call(self, method:str, **params):
+        '''Call any method of the telegram api, for example call('sendChatAction', chat_id=1, action='typing'). Returns the result of the method'''
+
+        #urllib is also imported only when something is sent
+        import urllib.error
+        import urllib.request
+
+        data = {key: _to_json(value) for key, value in params.items() if value is not None}
+        request = urllib.request.Request(API_URL.format(token=self.token, method=method), data=json.dumps(data).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                answer = json.loads(response.read())
+        except urllib.error.HTTPError as err:
+            #A proxy or a balancer in front of telegram may answer with html
+            try:
+                answer = json.loads(err.read() or b'{}')
+            except ValueError:
+                answer = {}
+            answer.setdefault('error_code', err.code)
+            answer.setdefault('description', str(err))
+
+        if not answer.get('ok'):
+            raise TelegramError(method, answer.get('error_code'), answer.get('description'))
+
+        return answer['result']
+
+
+    def send_message(self, chat_id, text:str, reply_markup=None, parse_mode:str = None, **params) -> dict:
+        '''Sending a message. Returns the message in the form of json'''
+
+        return self.call('sendMessage', chat_id=chat_id, text=text, reply_markup=reply_markup, parse_mode=parse_mode or self.parse_mode, **params)
+
+
+def _to_json(value):
+    '''Keyboards of telebot are converted to json by themselves'''
+
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+
+    return value
+
+
+def send(token:str, msg:str, chat_id, parse_mode:str = None) -> None:
+    '''
+    Send a message to a user or a list of users without creating a bot. Errors are printed and do not stop the sending to others
+    ----------------------
+    token:str - bot token
+    msg:str - a message to be sent
+    chat_id: - the chat ID of the user or channel. You can pass a list
+    parse_mode: str/None - how to format text, HTML or MARKDOWN
+    '''
+
+    api = NotifyApi(token, parse_mode)
+
+    if isinstance(chat_id, str) or isinstance(chat_id, int):
+        chat_id = [str(chat_id)]
+
+    for user_id in chat_id:
+        try:
+            api.send_message(user_id, str(msg))
+        except Exception as err:
+            print(f'''Failed to send message\nfile: {__file__}\nmsg: {msg}\nchat_id: {user_id}\nerror: {err}''')
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+'''Module with a scheduler of outgoing requests to telegram: priority lanes under a common rate limit'''
+
+import time
+import circuit
+import threading as th
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable
+
+
+#Lanes from the most urgent to the least. Weight - share of requests when all lanes are busy,
+#max_wait - after this number of seconds in the queue the request is sent out of turn (starvation protection)
+LANES = {
+    'interactive': {'weight': 16, 'max_wait': 1.0},
+    'normal': {'weight': 4, 'max_wait': 10.0},
+    'bulk': {'weight': 1, 'max_wait': 60.0},
+}
+
+
+class QueueOverflow(Exception):
+    '''The request was dropped from the queue: the lane is full (for example, telegram has been unavailable for a long time)'''
+
+
+class _Job:
+    '''One request in the queue'''
+
+    __slots__ = ('func', 'args', 'kwargs', 'future', 'lane', 'created', 'finish_tag', 'probe')
+
+    def __init__(self, func, args, kwargs, lane, finish_tag):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.lane = lane
+        self.created = time.monotonic()
+        self.finish_tag = finish_tag
+        self.probe = False #the request took the probe of the half-open circuit
+
+
+class OutboundScheduler:
+    '''
+    Sends requests to telegram through priority lanes (interactive, normal, bulk) with weighted fair queuing.
+    All lanes share one rate limit, so replies to users do not wait for the end of a broadcast.
+    ----------------------
+    methods:
+       submit - Add a request to the queue, returns Future
+       call - Add a request to the queue and wait for the result
+       stats - Latency statistics for each lane
+       stop - Stop the workers
+    '''
+
+    def __init__(self, rate:float = 30.0, burst:int = 30, workers:int = 4, lanes:dict = None, history:int = 1000, max_queued:int = 10000):
+        '''
+        rate:float - maximum number of requests per second for all lanes (telegram allows about 30 messages per second)
+        burst:int - how many requests can be sent at once after a pause
+        workers:int - number of threads that perform requests
+        lanes:dict - lane settings, as in LANES
+        history:int - number of recent requests of each lane used for latency statistics
+        max_queued:int - maximum number of requests waiting in each lane while the circuit is open. When it is exceeded, the oldest
+           requests are dropped (their Future receives QueueOverflow), so that a long outage does not fill the memory.
+           While telegram works, the queues are not limited: a big broadcast is sent completely
+        '''
+
+        self.rate = rate
+        self.burst = burst
+        self.workers = workers
+        self.lanes = lanes or LANES
+        self.max_queued = max_queued
+
+        self._queues = {lane: deque() for lane in self.lanes}
+        self._last_finish = {lane: 0.0 for lane in self.lanes}
+        self._latency = {lane: deque(maxlen=history) for lane in self.lanes}
+        self._counts = {lane: {'sent': 0, 'errors': 0, 'forced': 0, 'dropped': 0} for lane in self.lanes}
+        self._virtual_time = 0.0
+
+        self._tokens = float(burst)
+        self._token_time = time.monotonic()
+
+        self._condition = th.Condition()
+        self._threads = []
+        self._stopped = False
+
+        self.profiler = None #profiler.Profiler, if the requests should be profiled
+        self.circuit = None #circuit.CircuitBreaker: while it is open, requests stay in the queues and the workers do not wait for timeouts
+
+
+    def submit(self, func:Callable, *args, lane:str = 'normal', **kwargs) -> Future:
+        '''
+        Add a request to the queue
+        ----------------------
+        func: function - what to call, for example self.api.send_message
+        args, kwargs - parameters of the function
+        lane: str - interactive (answers to users), normal or bulk (broadcasts)
+        '''
+
+        if lane not in self._queues:
+            raise ValueError(f'Unknown lane: {lane}')
+
+        dropped = []
+
+        with self._condition:
+            if not self._threads:
+                self._start()
+
+            #Finish tag of weighted fair queuing: the lane with a larger weight moves through virtual time slower
+            start_tag = max(self._virtual_time, self._last_finish[lane])
+            finish_tag = start_tag + 1.0 / self.lanes[lane]['weight']
+            self._last_finish[lane] = finish_tag
+
+            job = _Job(func, args, kwargs, lane, finish_tag)
+            self._queues[lane].append(job)
+            self._condition.notify()
+
+            if self.circuit is not None and self.circuit.state != circuit.CLOSED:
+                while len(self._queues[lane]) > self.max_queued:
+                    dropped.append(self._queues[lane].popleft())
+                    self._counts[lane]['dropped'] += 1
+
+        #Outside the lock: callbacks of the Future may call the scheduler
+        for old in dropped:
+            if not old.future.cancelled():
+                old.future.set_exception(QueueOverflow(f'The lane {lane} is full, the oldest request was dropped'))
+
+        return job.future
+
+
+    def call(self, func:Callable, *args, lane:str = 'normal', **kwargs):
+        '''Add a request to the queue and wait for the result. Exceptions of the request are raised here'''
+
+        return self.submit(func, *args, lane=lane, **kwargs).result()
+
+
+    def stats(self) -> dict:
+        '''Statistics for each lane: sent, errors, forced, dropped, queued and latency (time from the queue to the answer of telegram, in seconds)'''
+
+        result = {}
+
+        with self._condition:
+            for lane in self.lanes:
+                latency = sorted(self._latency[lane])
+                result[lane] = dict(self._counts[lane])
+                result[lane]['queued'] = len(self._queues[lane])
+                result[lane]['p50'] = _percentile(latency, 0.50)
+                result[lane]['p99'] = _percentile(latency, 0.99)
+                result[lane]['max'] = latency[-1] if latency else 0.0
+
+        return result
+
+
+    def stop(self) -> None:
+        '''Stop the workers. Requests that are already in the queue are sent'''
+
+        with self._condition:
+            self._stopped = True
+            self._threads = []
+            self._condition.notify_all()
+
+
+    def _start(self) -> None:
+        '''Starts the workers on the first request'''
+
+        self._stopped = False
+        for i in range(self.workers):
+            thread = th.Thread(target=self._work, name=f'outbound-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+
+    def _next_job(self) -> _Job:
+        '''Waits for a request and a rate limit token, then returns the request. None - stop'''
+
+        with self._condition:
+            while True:
+                #Cancelled requests are removed before taking a token and the probe of the circuit
+                for queue in self._queues.values():
+                    while queue and queue[0].future.cancelled():
+                        queue.popleft()
+
+                heads = [queue[0] for queue in self._queues.values() if queue]
+
+                if not heads:
+                    if self._stopped:
+                        return None
+                    self._condition.wait()
+                    continue
+
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._token_time) * self.rate)
+                self._token_time = now
+
+                if self._tokens < 1:
+                    self._condition.wait((1 - self._tokens) / self.rate)
+                    continue
+
+                self._tokens -= 1
+
+                probe = False
+                if self.circuit is not None:
+                    wait = self.circuit.acquire()
+                    if wait:
+                        self._tokens += 1
+                        self._condition.wait(wait)
+                        continue
+                    probe = self.circuit.state == circuit.HALF_OPEN
+
+                #A request that has been waiting too long goes out of turn, otherwise the smallest finish tag
+                overdue = [job for job in heads if now - job.created > self.lanes[job.lane]['max_wait']]
+                if overdue:
+                    job = min(overdue, key=lambda job: job.created)
+                    self._counts[job.lane]['forced'] += 1
+                else:
+                    job = min(heads, key=lambda job: job.finish_tag)
+
+                self._queues[job.lane].popleft()
+                job.probe = probe
+                self._virtual_time = max(self._virtual_time, job.finish_tag - 1.0 / self.lanes[job.lane]['weight'])
+
+                return job
+
+
+    def _work(self) -> None:
+        '''Worker: performs requests from the queue'''
+
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+
+            if not job.future.set_running_or_notify_cancel():
+                #The request was cancelled after it was taken: otherwise the circuit would wait for the result of the probe forever
+                if job.probe:
+                    self.circuit.release_probe()
+                continue
+
+            error = None
+            start = time.monotonic()
+            try:
+                if self.profiler is not None and self.profiler.enabled:
+                    with self.profiler.section('outbound:' + getattr(job.func, '__name__', 'call')):
+                        result = job.func(*job.args, **job.kwargs)
+                else:
+                    result = job.func(*job.args, **job.kwargs)
+            except BaseException as err:
+                error = err
+
+            if self.circuit is not None:
+                self.circuit.record(error is not None and self.circuit.is_failure(error), time.monotonic() - start)
+
+            #Statistics are updated before the caller receives the result
+            with self._condition:
+                self._latency[job.lane].append(time.monotonic() - job.created)
+                self._counts[job.lane]['errors' if error is not None else 'sent'] += 1
+                #The circuit may have closed: the other workers should not sleep until the end of their pause
+                self._condition.notify_all()
+
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+
+
+def _percentile(values:list, share:float) -> float:
+    '''Percentile of the sorted list'''
+
+    if not values:
+        return 0.0
+
+    return values[min(len(values) - 1, int(len(values) * share))]
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+'''Module with a sampling profiler of handlers that can be turned on while the bot is running'''
+
+import os
+import sys
+import random
+import signal
+import functools
+import threading as th
+from typing import Callable
+
+
+class Profiler:
+    '''
+    Sampling profiler. Only a part of the handler calls is observed (sample_rate), and their stacks are
+    read by a separate thread every interval seconds, so the overhead is bounded even under load.
+    Stacks are collected in the collapsed format of flamegraph.pl / speedscope: "label;func;func count".
+    ----------------------
+    methods:
+       enable - Turn on profiling
+       disable - Turn off profiling
+       wrap - Wraps a function so that its calls are profiled
+       section - Context manager: profiles the code inside it
+       collapsed - Collected stacks in the collapsed format
+       dump - Writes the collected stacks to the file
+       reset - Clears the collected stacks
+       install_signal - Dump the stacks to the file by a signal
+    '''
+
+    def __init__(self, sample_rate:float = 0.1, interval:float = 0.005, max_stacks:int = 10000, max_depth:int = 64):
+        '''
+        sample_rate:float - the share of calls that are profiled, from 0 to 1
+        interval:float - how often the stacks are read, in seconds
+        max_stacks:int - maximum number of different stacks, new ones are dropped after that (memory limit)
+        max_depth:int - maximum stack depth
+        '''
+
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.max_depth = max_depth
+
+        self.enabled = False
+        self.stats = {'calls': 0, 'sampled_calls': 0, 'samples': 0, 'dropped': 0}
+
+        self._stacks = {}
+        self._active = {} #thread id -> (label of the profiled call, the frame above the call)
+        self._lock = th.Lock()
+        self._stop_event = th.Event()
+        self._thread = None
+
+
+    def enable(self, sample_rate:float = None) -> None:
+        '''
+        Turn on profiling
+        ----------------------
+        sample_rate:float - change the share of profiled calls
+        '''
+
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+
+        if self.enabled:
+            return
+
+        self.enabled = True
+        self._stop_event.clear()
+        self._thread = th.Thread(target=self._sample_loop, name='profiler', daemon=True)
+        self._thread.start()
+
+
+    def disable(self) -> None:
+        '''Turn off profiling. The collected stacks remain'''
+
+        self.enabled = False
+        self._stop_event.set()
+
+
+    def wrap(self, func:Callable, label:str = None) -> Callable:
+        '''
+        Wraps a function so that its calls are profiled. When profiling is off, the overhead is one check
+        ----------------------
+        func: function - handler
+        label:str - the root of the stacks of this function. By default, the name of the function
+        '''
+
+        label = label or getattr(func, '__qualname__', None) or repr(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+
+            with self.section(label):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+    def section(self, label:str) -> '_Section':
+        '''Context manager: profiles the code inside it (if this call gets into the sample)'''
+
+        return _Section(self, label)
+
+
+    def collapsed(self) -> str:
+        '''Collected stacks in the collapsed format: "label;func;func count" on each line'''
+
+        with self._lock:
+            lines = [f'{stack} {count}' for stack, count in sorted(self._stacks.items(), key=lambda item: -item[1])]
+
+        return '\n'.join(lines) + ('\n' if lines else '')
+
+
+    def dump(self, path:str) -> None:
+        '''Writes the collected stacks to the file'''
+
+        text = self.collapsed()
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.write(text)
+        os.replace(tmp_path, path)
+
+
+    def reset(self) -> None:
+        '''Clears the collected stacks and statistics'''
+
+        with self._lock:
+            self._stacks = {}
+            self.stats = {'calls': 0, 'sampled_calls': 0, 'samples': 0, 'dropped': 0}
+
+
+    def install_signal(self, path:str, signum:int = None) -> bool:
+        '''
+        Dump the stacks to the file when the process receives a signal (by default SIGUSR1: kill -USR1 <pid>).
+        Works only in the main thread and not on Windows. Returns False if the signal could not be installed
+        ----------------------
+        path:str - the file for the stacks
+        signum:int - signal number
+        '''
+
+        if signum is None:
+            signum = getattr(signal, 'SIGUSR1', None)
+
+        if signum is None or th.current_thread() is not th.main_thread():
+            return False
+
+        signal.signal(signum, lambda *args: self.dump(path))
+        return True
+
+
+    def _enter(self, label:str, stop_frame) -> bool:
+        '''Start of a profiled call. Returns True if the call got into the sample'''
+
+        self.stats['calls'] += 1
+        if not self.enabled or random.random() >= self.sample_rate:
+            return False
+
+        ident = th.get_ident()
+        with self._lock:
+            if ident in self._active:
+                #Nested profiled call: the outer one already observes the thread
+                return False
+
+            self._active[ident] = (label, stop_frame)
+            self.stats['sampled_calls'] += 1
+
+        return True
+
+
+    def _exit(self) -> None:
+        '''End of a profiled call'''
+
+        with self._lock:
+            self._active.pop(th.get_ident(), None)
+
+
+    def _sample_loop(self) -> None:
+        '''Every interval seconds reads the stacks of the threads that are in profiled calls'''
+
+        while not self._stop_event.wait(self.interval):
+            with self._lock:
+                if not self._active:
+                    continue
+                active = dict(self._active)
+
+            frames = sys._current_frames()
+
+            for ident, (label, stop_frame) in active.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    self._add_stack(label, frame, stop_frame)
+
+
+    def _add_stack(self, label:str, frame, stop_frame) -> None:
+        '''Adds the stack of the frame (up to stop_frame) to the statistics'''
+
+        names = []
+        #The frames above the call (threads of telebot) are the same for all calls and are not interesting
+        while frame is not None and frame is not stop_frame and len(names) < self.max_depth:
+            code = frame.f_code
+            if code.co_filename != __file__:
+                names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+
+        stack = label + ';' + ';'.join(reversed(names))
+
+        with self._lock:
+            self.stats['samples'] += 1
+            if stack in self._stacks:
+                self._stacks[stack] += 1
+            elif len(self._stacks) < self.max_stacks:
+                self._stacks[stack] = 1
+            else:
+                self.stats['dropped'] += 1
+
+
+class _Section:
+    '''Context manager of one profiled call'''
+
+    __slots__ = ('profiler', 'label', 'sampled')
+
+    def __init__(self, profiler:Profiler, label:str):
+        self.profiler = profiler
+        self.label = label
+        self.sampled = False
+
+
+    def __enter__(self):
+        self.sampled = self.profiler._enter(self.label, sys._getframe(1).f_back)
+        return self
+
+
+    def __exit__(self, *args):
+        if self.sampled:
+            self.profiler._exit()
@@ -0,0 +1,415 @@
+# -*- coding: utf-8 -*-
+'''Module with a scheduler that runs many periodic triggers in one thread on a hierarchical timer wheel'''
+
+import time
+import random
+import datetime
+import threading as th
+from typing import Callable, List
+
+
+class CronSpec:
+    '''
+    Cron-style schedule: "minute hour day month weekday". Supports *, */n, a-b, a-b/n and lists a,b,c.
+    Weekday: 0-6, 0 (or 7) = Sunday. If both day and weekday are specified, either one is enough, as in cron.
+    ----------------------
+    methods:
+       next_after - Returns the next launch time after the specified time
+    '''
+
+    _RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, spec:str):
+        '''spec:str - like "*/5 * * * *" (every 5 minutes) or "0 9 * * 1-5" (at 9:00 on weekdays)'''
+
+        fields = spec.split()
+        if len(fields) != 5:
+            raise ValueError(f'Cron spec must have 5 fields: {spec}')
+
+        self.spec = spec
+        self.minutes, self.hours, self.days, self.months, weekdays = [
+            self._parse(field, low, high) for field, (low, high) in zip(fields, self._RANGES)]
+
+        #Sunday can be written as 0 or 7, python counts from Monday = 0
+        self.weekdays = {(day - 1) % 7 for day in weekdays}
+
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+
+    @staticmethod
+    def _parse(field:str, low:int, high:int) -> set:
+        '''Parses one cron field into a set of numbers'''
+
+        values = set()
+
+        for part in field.split(','):
+            step = 1
+            if '/' in part:
+                part, step_text = part.split('/')
+                step = int(step_text)
+
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = (int(value) for value in part.split('-'))
+            else:
+                start = end = int(part)
+                if step != 1:
+                    end = high
+
+            if start < low or end > high or step < 1:
+                raise ValueError(f'Invalid cron field: {field}')
+
+            values.update(range(start, end + 1, step))
+
+        return values
+
+
+    def _day_matches(self, day:datetime.datetime) -> bool:
+        '''Checks the day of the month and the day of the week'''
+
+        day_ok = day.day in self.days
+        weekday_ok = day.weekday() in self.weekdays
+
+        if self._any_day:
+            return weekday_ok
+        if self._any_weekday:
+            return day_ok
+
+        return day_ok or weekday_ok
+
+
+    def next_after(self, timestamp:float) -> float:
+        '''Returns the next launch time (unix time) after the specified time'''
+
+        moment = datetime.datetime.fromtimestamp(timestamp).replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = moment + datetime.timedelta(days=366 * 5)
+
+        while moment < limit:
+            if moment.month not in self.months:
+                year = moment.year + moment.month // 12
+                moment = moment.replace(year=year, month=moment.month % 12 + 1, day=1, hour=0, minute=0)
+                continue
+
+            if not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+                continue
+
+            if moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + datetime.timedelta(hours=1)
+                continue
+
+            if moment.minute not in self.minutes:
+                moment += datetime.timedelta(minutes=1)
+                continue
+
+            return moment.timestamp()
+
+        raise ValueError(f'Cron spec never fires: {self.spec}')
+
+
+class Trigger:
+    '''A periodic task of the scheduler with its launch statistics'''
+
+    def __init__(self, func:Callable, interval:float = None, cron:str = None, jitter:float = 0.0, args:tuple = (), kwargs:dict = None,
+                 name:str = None, stop_on_result:bool = False):
+        '''
+        func: function - what to run
+        interval:float - launch every interval seconds
+        cron:str - or launch by cron-style schedule like "*/5 * * * *"
+        jitter:float - random delay from 0 to jitter seconds is added to each launch, so that triggers do not fire all at once
+        args, kwargs - parameters of the function
+        name:str - trigger name in the statistics. By default, the name of the function
+        stop_on_result:bool - stop the trigger when the function returns a truthy value (e.g. a non-zero status code)
+        '''
+
+        if (interval is None) == (cron is None):
+            raise ValueError('Specify either interval or cron')
+
+        if interval is not None and interval <= 0:
+            raise ValueError('The interval must be positive')
+
+        self.func = func
+        self.interval = interval
+        self.cron = None if cron is None else CronSpec(cron)
+        self.jitter = jitter
+        self.args = tuple(args)
+        self.kwargs = kwargs or {}
+        self.name = name or getattr(func, '__name__', repr(func))
+        self.stop_on_result = stop_on_result
+
+        self.active = True
+        self.due = 0.0 #monotonic time of the next launch, without jitter
+        self.delay = 0.0 #jitter of the next launch: the trigger fires at due + delay
+        self.tick = 0  #tick of the timer wheel
+
+        self.runs = 0
+        self.errors = 0
+        self.overruns = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.max_lateness = 0.0
+        self.last_result = None
+
+
+    def next_due(self, now:float) -> float:
+        '''Returns the monotonic time of the next launch after the monotonic time now. Jitter is not included, it is added when the trigger is put on the wheel'''
+
+        if self.interval is not None:
+            due = now + self.interval
+        else:
+            #The cron time is absolute: the next minute after the wall time that corresponds to now, converted back to monotonic time
+            offset = time.time() - time.monotonic()
+            due = self.cron.next_after(now + offset) - offset
+
+        return due
+
+
+    def stats(self) -> dict:
+        '''Launch statistics'''
+
+        return {
+            'runs': self.runs,
+            'errors': self.errors,
+            'overruns': self.overruns,
+            'avg_time': self.total_time / self.runs if self.runs else 0.0,
+            'max_time': self.max_time,
+            'max_lateness': self.max_lateness,
+            'last_result': self.last_result,
+            'active': self.active
+        }
+
+
+class TimerWheel:
+    '''
+    Hierarchical timer wheel. Adding and removing a timer is O(1), one tick is O(1) on average
+    regardless of how many timers are waiting.
+    ----------------------
+    methods:
+       add - Adds a trigger that will expire at the specified tick
+       advance - Moves the wheel one tick forward and returns the expired triggers
+    '''
+
+    def __init__(self, slots:int = 64, levels:int = 4):
+        '''
+        slots:int - number of slots on each level
+        levels:int - number of levels. The lowest level covers slots ticks, each next one - slots times more
+        '''
+
+        self.slots = slots
+        self.levels = levels
+        self.current = 0
+
+        self._wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+
+
+    def add(self, trigger:Trigger, tick:int) -> None:
+        '''Adds a trigger that will expire at the specified tick. Past ticks expire on the next advance'''
+
+        trigger.tick = max(tick, self.current + 1)
+        self._place(trigger)
+
+
+    def _place(self, trigger:Trigger) -> None:
+        '''Puts the trigger in the slot of the required level'''
+
+        delta = trigger.tick - self.current
+        span = 1
+
+        for level in range(self.levels):
+            if delta < span * self.slots or level == self.levels - 1:
+                self._wheels[level][(trigger.tick // span) % self.slots].append(trigger)
+                return
+
+            span *= self.slots
+
+
+    def advance(self) -> List[Trigger]:
+        '''Moves the wheel one tick forward and returns the expired triggers'''
+
+        self.current += 1
+
+        #Triggers from the upper levels move down when their slot comes
+        for level in range(self.levels - 1, 0, -1):
+            span = self.slots ** level
+            if self.current % span == 0:
+                slot = self._wheels[level][(self.current // span) % self.slots]
+                self._wheels[level][(self.current // span) % self.slots] = []
+                for trigger in slot:
+                    self._place(trigger)
+
+        index = self.current % self.slots
+        slot = self._wheels[0][index]
+        self._wheels[0][index] = []
+
+        expired = []
+        for trigger in slot:
+            if trigger.tick <= self.current:
+                expired.append(trigger)
+            else:
+                self._place(trigger)
+
+        return expired
+
+
+class Scheduler:
+    '''
+    Runs all triggers in one thread. A trigger that runs longer than its interval is counted as an overrun
+    and its missed launches are skipped.
+    ----------------------
+    methods:
+       add - Adds a periodic trigger
+       remove - Stops the trigger
+       start - Start the scheduler
+       stop - Stop the scheduler
+       stats - Statistics for all triggers
+    '''
+
+    def __init__(self, tick:float = 0.1):
+        '''tick:float - accuracy of the scheduler in seconds'''
+
+        self.tick = tick
+        self.triggers = []
+        self.active_count = 0
+
+        self._wheel = TimerWheel()
+        self._lock = th.Lock()
+        self._stop_event = th.Event()
+        self._start_time = None
+        self._thread = None
+
+
+    def add(self, func:Callable, interval:float = None, cron:str = None, jitter:float = 0.0, args:tuple = (), kwargs:dict = None,
+            name:str = None, stop_on_result:bool = False, run_now:bool = False) -> Trigger:
+        '''
+        Adds a periodic trigger. Parameters as in Trigger
+        ----------------------
+        run_now:bool - the first launch immediately, and not after the interval
+        '''
+
+        trigger = Trigger(func, interval, cron, jitter, args, kwargs, name, stop_on_result)
+
+        with self._lock:
+            now = time.monotonic()
+            trigger.due = now if run_now else trigger.next_due(now)
+            self.triggers.append(trigger)
+            self.active_count += 1
+            self._schedule(trigger, jitter=not run_now)
+
+        return trigger
+
+
+    def remove(self, trigger:Trigger) -> None:
+        '''Stops the trigger. It will be dropped from the wheel when its slot comes, its statistics remain'''
+
+        with self._lock:
+            if trigger.active:
+                trigger.active = False
+                self.active_count -= 1
+
+
+    def start(self, separate_thread:bool = True) -> None:
+        '''
+        Start the scheduler. It works until stop is called or until all triggers are stopped
+        ----------------------
+        separate_thread:bool - Whether to run in a separate thread or loop execution here
+        '''
+
+        self._stop_event.clear()
+
+        if separate_thread:
+            self._thread = th.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        else:
+            self._run()
+
+
+    def stop(self) -> None:
+        '''Stop the scheduler'''
+
+        self._stop_event.set()
+
+
+    def stats(self) -> dict:
+        '''Statistics for all triggers: {name: {...}}'''
+
+        with self._lock:
+            return {trigger.name: trigger.stats() for trigger in self.triggers}
+
+
+    def _tick_of(self, due:float) -> int:
+        '''The tick of the wheel at which the time comes'''
+
+        if self._start_time is None:
+            self._start_time = time.monotonic()
+
+        return int((due - self._start_time) / self.tick + 0.999999)
+
+
+    def _schedule(self, trigger:Trigger, jitter:bool = True) -> None:
+        '''Puts the trigger on the wheel. Jitter shifts only this launch, the next one is counted from the time without jitter, so it does not add up'''
+
+        trigger.delay = random.uniform(0, trigger.jitter) if jitter and trigger.jitter else 0.0
+        self._wheel.add(trigger, self._tick_of(trigger.due + trigger.delay))
+
+
+    def _run(self) -> None:
+        '''The main loop: wait for the next tick and launch the expired triggers'''
+
+        if self._start_time is None:
+            self._start_time = time.monotonic()
+
+        while not self._stop_event.is_set():
+            if not self.active_count:
+                break
+
+            next_tick_time = self._start_time + (self._wheel.current + 1) * self.tick
+            delay = next_tick_time - time.monotonic()
+
+            if delay > 0 and self._stop_event.wait(delay):
+                break
+
+            with self._lock:
+                expired = self._wheel.advance()
+
+            for trigger in expired:
+                if trigger.active:
+                    self._launch(trigger)
+
+
+    def _launch(self, trigger:Trigger) -> None:
+        '''Runs the trigger, collects statistics and puts it back on the wheel'''
+
+        start = time.monotonic()
+        trigger.max_lateness = max(trigger.max_lateness, start - trigger.due - trigger.delay)
+
+        try:
+            trigger.last_result = trigger.func(*trigger.args, **trigger.kwargs)
+        except Exception as err:
+            trigger.errors += 1
+            trigger.last_result = None
+            print(f'Trigger {trigger.name} failed: {err!r}')
+
+        end = time.monotonic()
+        duration = end - start
+
+        trigger.runs += 1
+        trigger.total_time += duration
+        trigger.max_time = max(trigger.max_time, duration)
+
+        if trigger.stop_on_result and trigger.last_result:
+            self.remove(trigger)
+            return
+
+        due = trigger.next_due(trigger.due)
+        if due <= end:
+            #The launch took longer than the interval (or the scheduler was busy). Skipping missed launches
+            trigger.overruns += 1
+            due = trigger.next_due(end)
+
+        trigger.due = due
+
+        with self._lock:
+            if trigger.active:
+                self._schedule(trigger)
@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+'''
+Module for running bots in several processes, so that CPU-heavy handlers are not limited by one core.
+Bots (or the chats of one bot) are distributed among the worker processes by consistent hashing,
+and all requests to telegram go through the supervisor, which keeps the common rate limit.
+'''
+
+import os
+import time
+import queue
+import bisect
+import hashlib
+import itertools
+import threading as th
+import multiprocessing as mp
+from typing import Callable, List
+
+
+class ShardRing:
+    '''
+    Consistent hashing: when a worker is added or removed, only a small part of the keys move to another worker
+    ----------------------
+    methods:
+       node_for - Returns the node for the key
+    '''
+
+    def __init__(self, nodes:List[str], replicas:int = 100):
+        '''
+        nodes: List[str] - names of the nodes (workers)
+        replicas:int - number of points of each node on the ring, the more - the more even the distribution
+        '''
+
+        self._ring = []
+        for node in nodes:
+            for i in range(replicas):
+                self._ring.append((_hash(f'{node}#{i}'), node))
+
+        self._ring.sort()
+        self._points = [point for point, node in self._ring]
+
+
+    def node_for(self, key) -> str:
+        '''Returns the node for the key'''
+
+        index = bisect.bisect(self._points, _hash(str(key))) % len(self._ring)
+        return self._ring[index][1]
+
+
+def _hash(text:str) -> int:
+    '''Stable hash (the built-in hash of strings is different in each process)'''
+
+    return int.from_bytes(hashlib.md5(text.encode('utf-8')).digest()[:8], 'big')
+
+
+def chat_of(raw_update:dict):
+    '''Returns the chat (or user) id of the raw update, so that all updates of one chat go to one worker'''
+
+    for field, value in raw_update.items():
+        if not isinstance(value, dict):
+            continue
+
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat is not None:
+            return chat.get('id')
+
+        user = value.get('from') or value.get('user')
+        if user is not None:
+            return user.get('id')
+
+    return raw_update.get('update_id')
+
+
+class _RemoteSender:
+    '''
+    Replaces the sending of http requests by telebot in the worker process (apihelper.CUSTOM_REQUEST_SENDER):
+    the request is passed to the supervisor and the worker waits for its answer.
+    Request ids contain the pid, so late answers to the requests of a crashed worker are not taken by the restarted one
+    '''
+
+    def __init__(self, index:int, outbox, responses, response_timeout:float = 60.0):
+        self.index = index
+        self.outbox = outbox
+        self.responses = responses
+        self.response_timeout = response_timeout
+        self.pid = os.getpid()
+
+        self._ids = itertools.count()
+        self._waiting = {}
+        self._lock = th.Lock()
+
+        th.Thread(target=self._receive, daemon=True).start()
+
+
+    def __call__(self, method, url, params=None, files=None, timeout=None, proxies=None):
+        import requests
+
+        if url.endswith('/getUpdates'):
+            #Long polling of the bot that lives in this worker: it does not send anything and must not take the rate limit
+            return requests.request(method, url, params=params, files=files, timeout=timeout, proxies=proxies)
+
+        if files:
+            files = {key: _file_bytes(key, value) for key, value in files.items()}
+
+        request_id = (self.pid, next(self._ids))
+        done = th.Event()
+        slot = [done, None]
+
+        with self._lock:
+            self._waiting[request_id] = slot
+
+        self.outbox.put(('request', self.index, request_id, method, url, params, files, timeout))
+
+        #The request itself may take its timeout, response_timeout is added for the queue of the supervisor
+        limit = sum(timeout) if isinstance(timeout, tuple) else (timeout or 0)
+        if not done.wait(limit + self.response_timeout):
+            with self._lock:
+                self._waiting.pop(request_id, None)
+            raise requests.ConnectionError(f'The supervisor did not answer in {limit + self.response_timeout} s')
+
+        result = slot[1]
+        if result[0] == 'error':
+            raise requests.ConnectionError(result[1])
+
+        return _Response(*result[1:])
+
+
+    def _receive(self) -> None:
+        '''Receives the answers of the supervisor'''
+
+        while True:
+            request_id, result = self.responses.get()
+
+            with self._lock:
+                #An answer to a request of a previous process or to a request that stopped waiting is dropped
+                slot = self._waiting.pop(request_id, None)
+
+            if slot is not None:
+                slot[1] = result
+                slot[0].set()
+
+
+class _Response:
+    '''The answer of telegram received from the supervisor, with the fields that telebot reads'''
+
+    def __init__(self, status_code:int, reason:str, text:str):
+        self.status_code = status_code
+        self.reason = reason
+        self.text = text
+
+
+    def json(self):
+        import json
+        return json.loads(self.text)
+
+
+def _file_bytes(key:str, value) -> tuple:
+    '''Files cannot be passed between processes, their contents are passed'''
+
+    if isinstance(value, tuple):
+        name, file = value[0], value[1]
+    else:
+        name, file = os.path.basename(getattr(value, 'name', key)), value
+
+    data = file.read() if hasattr(file, 'read') else file
+    return (name, data)
+
+
+def _worker_main(index:int, factories:dict, inbox, outbox, responses) -> None:
+    '''The main function of the worker process'''
+
+    import telebot
+    import lite_update
+
+    telebot.apihelper.CUSTOM_REQUEST_SENDER = _RemoteSender(index, outbox, responses)
+
+    bots = {}
+    processed = 0
+    last_report = 0.0
+
+    def get_bot(name):
+        if name not in bots:
+            bot = factories[name]()
+            #The supervisor already took the updates from telegram, the bot only processes them
+            bot.backlog_policy = None
+            bot.offset_store = None
+            bot._wrap_process_updates()
+            bots[name] = bot
+        return bots[name]
+
+    while True:
+        try:
+            message = inbox.get(timeout=1)
+        except queue.Empty:
+            message = ('idle',)
+
+        if message is None:
+            break
+
+        if message[0] == 'poll':
+            #The whole bot lives in this worker
+            get_bot(message[1]).start_listen()
+
+        elif message[0] == 'updates':
+            bot = get_bot(message[1])
+            updates = lite_update.parse_updates(message[2], bot.lite_handlers, telebot.types.Update.de_json)
+            bot.api.process_new_updates(updates)
+            processed += len(updates)
+
+        #Handlers work in the threads of telebot, so the load is the CPU time of the whole process, not the time of this loop
+        now = time.monotonic()
+        if now - last_report >= 1:
+            outbox.put(('load', index, processed, time.process_time()))
+            last_report = now
+
+
+class Supervisor:
+    '''
+    Starts worker processes and distributes bots among them. A bot is either placed entirely in one worker
+    (it polls telegram itself), or its chats are distributed among all workers (the supervisor polls telegram).
+    Requests of all workers to telegram are performed by the supervisor through OutboundScheduler with one rate limit per bot.
+    Crashed workers are restarted.
+    ----------------------
+    methods:
+       add_bot - Add a bot
+       start - Start the workers (and polling of the bots whose chats are distributed)
+       stop - Stop everything
+       load_stats - Load of each worker
+    '''
+
+    def __init__(self, workers:int = None, rate:float = 30.0, check_interval:float = 1.0):
+        '''
+        workers:int - number of worker processes. By default, the number of cores
+        rate:float - maximum number of requests per second of each bot
+        check_interval:float - how often to check that the workers are alive, in seconds
+        '''
+
+        self.workers = workers or os.cpu_count() or 1
+        self.rate = rate
+        self.check_interval = check_interval
+
+        self.names = [f'worker-{i}' for i in range(self.workers)]
+        self.ring = ShardRing(self.names)
+
+        self._factories = {}
+        self._tokens = {}
+        self._shard_chats = {}
+        self._senders = {}
+        self._processes = [None] * self.workers
+        self._inboxes = []
+        self._responses = []
+        self._outbox = None
+        self._stop_event = th.Event()
+        self._load = [{'restarts': 0, 'updates': 0, 'busy': 0.0} for _ in range(self.workers)]
+
+
+    def add_bot(self, name:str, token:str, factory:Callable, shard_chats:bool = False) -> None:
+        '''
+        Add a bot
+        ----------------------
+        name:str - unique name of the bot
+        token:str - bot token, the supervisor polls telegram with it if shard_chats
+        factory: function - creates the bot (TelegramBotParent) in the worker. It must be a function or class of a module,
+           so that it can be passed to another process
+        shard_chats:bool - distribute the chats of the bot among all workers, and not place the bot in one worker
+        '''
+
+        self._factories[name] = factory
+        self._tokens[name] = token
+        self._shard_chats[name] = shard_chats
+
+
+    def start(self) -> None:
+        '''Start the workers (and polling of the bots whose chats are distributed)'''
+
+        import outbound
+
+        self._stop_event.clear()
+        self._outbox = mp.Queue()
+        self._inboxes = [mp.Queue() for _ in range(self.workers)]
+        self._responses = [mp.Queue() for _ in range(self.workers)]
+
+        for token in set(self._tokens.values()):
+            self._senders[token] = outbound.OutboundScheduler(rate=self.rate, burst=int(self.rate))
+
+        for index in range(self.workers):
+            self._start_worker(index)
+
+        th.Thread(target=self._serve_requests, daemon=True).start()
+        th.Thread(target=self._watch_workers, daemon=True).start()
+
+        for name in self._factories:
+            if self._shard_chats[name]:
+                th.Thread(target=self._poll, args=(name,), daemon=True).start()
+
+
+    def stop(self) -> None:
+        '''Stop everything'''
+
+        self._stop_event.set()
+
+        for inbox in self._inboxes:
+            inbox.put(None)
+
+        for process in self._processes:
+            if process is not None:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+
+
+    def load_stats(self) -> dict:
+        '''Load of each worker: pid, alive, restarts, updates (processed), busy (CPU seconds of the process, handlers included), queued (waiting updates)'''
+
+        stats = {}
+        for index, name in enumerate(self.names):
+            process = self._processes[index]
+            stats[name] = dict(self._load[index])
+            stats[name]['pid'] = process.pid if process is not None else None
+            stats[name]['alive'] = process is not None and process.is_alive()
+
+            try:
+                stats[name]['queued'] = self._inboxes[index].qsize()
+            except (NotImplementedError, IndexError):
+                stats[name]['queued'] = None
+
+        return stats
+
+
+    def _start_worker(self, index:int) -> None:
+        '''Starts (or restarts) the worker process and gives it its bots'''
+
+        if self._processes[index] is not None:
+            #Answers to the requests of the crashed process must not get to the new one
+            self._responses[index] = mp.Queue()
+
+        process = mp.Process(target=_worker_main, name=self.names[index], daemon=True,
+                             args=(index, self._factories, self._inboxes[index], self._outbox, self._responses[index]))
+        process.start()
+        self._processes[index] = process
+
+        for name in self._factories:
+            if not self._shard_chats[name] and self.ring.node_for(name) == self.names[index]:
+                self._inboxes[index].put(('poll', name))
+
+
+    def _watch_workers(self) -> None:
+        '''Restarts crashed workers'''
+
+        while not self._stop_event.wait(self.check_interval):
+            for index, process in enumerate(self._processes):
+                if process is not None and not process.is_alive() and not self._stop_event.is_set():
+                    self._load[index]['restarts'] += 1
+                    self._start_worker(index)
+
+
+    def _poll(self, name:str) -> None:
+        '''Polls telegram for the bot and distributes updates among the workers by chats'''
+
+        import telebot
+
+        token = self._tokens[name]
+        offset = 0
+
+        while not self._stop_event.is_set():
+            try:
+                raw_updates = telebot.apihelper.get_updates(token, offset=offset, timeout=25, long_polling_timeout=20)
+            except Exception as err:
+                print(f'Failed to get updates of the bot {name}: {err!r}')
+                time.sleep(3)
+                continue
+
+            batches = {}
+            for raw in raw_updates:
+                offset = max(offset, raw['update_id'] + 1)
+                worker = self.names.index(self.ring.node_for(chat_of(raw)))
+                batches.setdefault(worker, []).append(raw)
+
+            for worker, batch in batches.items():
+                self._inboxes[worker].put(('updates', name, batch))
+
+
+    def _serve_requests(self) -> None:
+        '''Performs the requests of the workers through the common rate limit and returns the answers'''
+
+        while not self._stop_event.is_set():
+            try:
+                message = self._outbox.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            if message[0] == 'load':
+                index, processed, busy = message[1:]
+                self._load[index]['updates'] = processed
+                self._load[index]['busy'] = busy
+                continue
+
+            index, request_id, method, url, params, files, timeout = message[1:]
+            sender = self._sender_for(url)
+            future = sender.submit(_perform, method, url, params, files, timeout, lane='normal')
+            future.add_done_callback(lambda done, index=index, request_id=request_id: self._respond(index, request_id, done))
+
+
+    def _sender_for(self, url:str):
+        '''The scheduler of the bot whose token is in the url'''
+
+        for token, sender in self._senders.items():
+            if token in url:
+                return sender
+
+        import outbound
+        return self._senders.setdefault(url.split('/')[3], outbound.OutboundScheduler(rate=self.rate, burst=int(self.rate)))
+
+
+    def _respond(self, index:int, request_id:int, future) -> None:
+        '''Returns the answer of telegram to the worker'''
+
+        try:
+            result = ('ok',) + future.result()
+        except Exception as err:
+            result = ('error', repr(err))
+
+        self._responses[index].put((request_id, result))
+
+
+def _perform(method:str, url:str, params:dict, files:dict, timeout) -> tuple:
+    '''Performs the request of the worker'''
+
+    import requests
+
+    response = requests.request(method, url, params=params, files=files, timeout=timeout)
+    return (response.status_code, response.reason, response.text)
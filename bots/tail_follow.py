@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+'''Module for following growing files (logs): only new lines are read, rotation and truncation are taken into account'''
+
+import os
+import re
+import json
+from typing import Callable, List
+
+
+class FileTail:
+    '''
+    Follows one file like "tail -F". Remembers the byte offset and the inode of the file,
+    reads only the appended bytes in chunks, so memory does not depend on the size of the file.
+    ----------------------
+    methods:
+       read_lines - Returns the new complete lines of the file
+       state - The position in the file for saving
+       close - Closes the file
+    '''
+
+    def __init__(self, path:str, from_start:bool = False, state:dict = None, chunk_size:int = 64 * 1024, max_line:int = 64 * 1024):
+        '''
+        path:str - the file to follow
+        from_start:bool - read the file from the beginning, and not only what will be added
+        state:dict - saved position {'inode': int, 'dev': int, 'offset': int}. It is used if the file has not been replaced
+        chunk_size:int - how many bytes to read at a time
+        max_line:int - longer lines are cut off
+        '''
+
+        self.path = path
+        self.chunk_size = chunk_size
+        self.max_line = max_line
+
+        self.inode = None
+        self.dev = None
+        self.offset = 0
+        self.rotations = 0
+        self.truncations = 0
+
+        self._file = None
+        self._partial = b''
+
+        self._open(from_start, state)
+
+
+    def _open(self, from_start:bool, state:dict = None) -> bool:
+        '''Opens the file and sets the position. Returns False if the file does not exist'''
+
+        try:
+            file = open(self.path, 'rb')
+        except OSError:
+            return False
+
+        info = os.fstat(file.fileno())
+        self._file = file
+        self.inode, self.dev = info.st_ino, info.st_dev
+        self._partial = b''
+
+        if state and state.get('inode') == self.inode and state.get('dev') == self.dev and state.get('offset', 0) <= info.st_size:
+            self.offset = state['offset']
+        elif from_start or state:
+            #A saved position of another file means that the file was replaced while we were not working
+            self.offset = 0
+        else:
+            self.offset = info.st_size
+
+        file.seek(self.offset)
+        return True
+
+
+    def read_lines(self, max_bytes:int = None) -> List[str]:
+        '''
+        Returns the new complete lines of the file. The incomplete last line waits for the next call
+        ----------------------
+        max_bytes:int - read no more than this number of bytes per call (the rest on the next call). None - to the end
+        '''
+
+        if self._file is None:
+            if not self._open(from_start=True):
+                return []
+
+        lines = []
+
+        try:
+            info = os.stat(self.path)
+        except OSError:
+            info = None
+
+        if info is not None and (info.st_ino, info.st_dev) != (self.inode, self.dev):
+            #The file was rotated: we read the rest of the old one and move on to the new one.
+            #The rest is also read by max_bytes, the old file stays open until it is read to the end
+            start = self.offset
+            lines += self._read(max_bytes)
+            if self.offset < os.fstat(self._file.fileno()).st_size:
+                return lines
+
+            lines += self._flush_partial()
+            self.close()
+            self.rotations += 1
+
+            if max_bytes is not None:
+                max_bytes -= self.offset - start
+            if self._open(from_start=True):
+                lines += self._read(max_bytes)
+
+            return lines
+
+        if info is not None and info.st_size < self.offset:
+            #The file was truncated
+            self.truncations += 1
+            self.offset = 0
+            self._partial = b''
+            self._file.seek(0)
+
+        return lines + self._read(max_bytes)
+
+
+    def _read(self, max_bytes:int = None) -> List[str]:
+        '''Reads the appended bytes in chunks and splits them into lines'''
+
+        lines = []
+        read = 0
+
+        while max_bytes is None or read < max_bytes:
+            size = self.chunk_size if max_bytes is None else min(self.chunk_size, max_bytes - read)
+            chunk = self._file.read(size)
+            if not chunk:
+                break
+
+            read += len(chunk)
+            self.offset += len(chunk)
+
+            parts = (self._partial + chunk).split(b'\n')
+            self._partial = parts.pop()
+
+            if len(self._partial) > self.max_line:
+                parts.append(self._partial[:self.max_line])
+                self._partial = b''
+
+            for part in parts:
+                lines.append(part[:self.max_line].rstrip(b'\r').decode('utf-8', errors='replace'))
+
+        return lines
+
+
+    def _flush_partial(self) -> List[str]:
+        '''Returns the incomplete last line, if it is there'''
+
+        if not self._partial:
+            return []
+
+        line = self._partial.decode('utf-8', errors='replace')
+        self._partial = b''
+        return [line]
+
+
+    def state(self) -> dict:
+        '''The position in the file for saving. The incomplete line is read again after a restart'''
+
+        return {'inode': self.inode, 'dev': self.dev, 'offset': self.offset - len(self._partial)}
+
+
+    def close(self) -> None:
+        '''Closes the file'''
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class TailNotifier:
+    '''
+    Follows several files and sends the lines that match the patterns in batches
+    ----------------------
+    methods:
+       check - Reads new lines from all files and sends matching ones. Suitable as a trigger of the scheduler
+       save_state - Saves positions in files
+    '''
+
+    def __init__(self, paths:List[str], patterns:List[str], send:Callable, state_file:str = None, from_start:bool = False,
+                 batch_lines:int = 50, batch_chars:int = 4000, max_bytes:int = 16 * 1024 * 1024):
+        '''
+        paths: List[str] - files to follow
+        patterns: List[str] - regular expressions. A line is sent if at least one of them is found in it. Empty list - all lines
+        send: function - function(text) that sends a message
+        state_file:str - file where the positions are saved, so as not to send the same lines after a restart
+        from_start:bool - read the files from the beginning (if there is no saved position)
+        batch_lines:int, batch_chars:int - the maximum number of lines and characters in one message (telegram limit is 4096 characters)
+        max_bytes:int - read no more than this number of bytes of one file per check
+        '''
+
+        self.send = send
+        self.state_file = state_file
+        self.batch_lines = batch_lines
+        self.batch_chars = batch_chars
+        self.max_bytes = max_bytes
+
+        #One regular expression for all patterns: one pass over the line instead of one per pattern
+        self.pattern = re.compile('|'.join(f'(?:{pattern})' for pattern in patterns)) if patterns else None
+
+        self.stats = {'lines': 0, 'matched': 0, 'messages': 0}
+
+        states = self._load_state()
+        self.tails = [FileTail(path, from_start, states.get(path)) for path in paths]
+
+
+    def _load_state(self) -> dict:
+        '''Reads the saved positions'''
+
+        if self.state_file is None:
+            return {}
+
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+
+    def save_state(self) -> None:
+        '''Saves positions in files'''
+
+        if self.state_file is None:
+            return
+
+        tmp_path = self.state_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({tail.path: tail.state() for tail in self.tails}, file)
+        os.replace(tmp_path, self.state_file)
+
+
+    def check(self) -> int:
+        '''Reads new lines from all files and sends matching ones. Returns the number of sent lines'''
+
+        sent = 0
+
+        for tail in self.tails:
+            lines = tail.read_lines(self.max_bytes)
+            self.stats['lines'] += len(lines)
+
+            if self.pattern is not None:
+                lines = [line for line in lines if self.pattern.search(line)]
+
+            if lines:
+                self._send_batches(tail.path, lines)
+                sent += len(lines)
+
+        self.stats['matched'] += sent
+        self.save_state()
+
+        return sent
+
+
+    def _send_batches(self, path:str, lines:List[str]) -> None:
+        '''Sends lines in messages that fit into the limits'''
+
+        header = os.path.basename(path) + ':\n'
+        batch = []
+        size = len(header)
+
+        for line in lines:
+            line = line[:self.batch_chars - len(header) - 1]
+
+            if batch and (len(batch) >= self.batch_lines or size + len(line) + 1 > self.batch_chars):
+                self.send(header + '\n'.join(batch))
+                self.stats['messages'] += 1
+                batch = []
+                size = len(header)
+
+            batch.append(line)
+            size += len(line) + 1
+
+        if batch:
+            self.send(header + '\n'.join(batch))
+            self.stats['messages'] += 1
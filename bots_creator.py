@@ -2,10 +2,20 @@
 '''This module contains a class that creates new telegram bots. The final product of the module is a py file with a new bot.'''
 
 import os
+import re
+import ast
 import sys
 import sqlite3
 import logging
-from typing import List
+import textwrap
+from typing import Iterator, List
+
+
+#Placeholders of the fragments: {name}
+_PLACEHOLDER = re.compile(r'\{(\w+)\}')
+
+#Marks a parameter of __init__ without a default value
+_NO_DEFAULT = object()
 
 
 class NotificationsFunctional:
@@ -28,11 +38,17 @@ class NotificationsFunctional:
                 You can leave None and send notifications via the <bot>.send method.
         notif_func_args: List[*args, **kwargs] (optional) - parameters of the function that triggers notifications.
                 The first element of the list is a list of variables, the second element is a dictionary of variables and default values.
+        notif_schedule: dict (optional) - adds the start_notifications method, which runs notificationTrigger on the scheduler of the bot.
+                Keys are the parameters of TelegramBotParent.add_trigger: interval, cron, jitter, args, kwargs, name, stop_on_result, run_now.
+                For example: {'interval': 1, 'args': ['data.txt'], 'stop_on_result': True}
         '''
 
         init_code = ''
         code = ''
 
+        #Attributes that the own __init__ code of the bot already sets, they must not be overwritten by the defaults
+        assigned = _assigned_attributes(kwargs.get('init_code'))
+
         try:
             users_type = kwargs.get('users_type')
             if users_type is None:
@@ -48,7 +64,8 @@ class NotificationsFunctional:
             users = kwargs.get('users', default_users)
 
             if users_type == 0:
-                init_code += ' '*8 + 'self.users = ' + str(users) + '\n'
+                if 'users' in kwargs or 'users' not in assigned:
+                    init_code += ' '*8 + 'self.users = ' + str(users) + '\n'
 
             elif users_type == 1:
                 path = users
@@ -68,12 +85,11 @@ class NotificationsFunctional:
                 init_code += ' '*8 + 'self.users = ' + str(users) + '\n'
 
             elif users_type == 2:
-                init_code += self.get_code('user_list_func').format(own_code=users)
+                init_code += render_text(self.get_code('user_list_func'), own_code=users)
 
             notif_func = kwargs.get('notif_func')
 
             if not notif_func is None:
-                unformatted_code = ''
 
                 notif_args = kwargs.get('notif_func_args', [[], {}])
 
@@ -95,10 +111,13 @@ class NotificationsFunctional:
                 notif_args_text += end_args
 
                 notif_func = notif_func.replace('\t', '    ')
-                for line in notif_func.split('\n'):
-                    unformatted_code += ' '*8 + line + '\n'
+                own_code = (' '*8 + line + '\n' for line in notif_func.split('\n'))
 
-                code = self.get_code('trigger').format(own_code=unformatted_code, notif_args=notif_args_text)
+                code = render_text(self.get_code('trigger'), own_code=own_code, notif_args=notif_args_text)
+
+                notif_schedule = kwargs.get('notif_schedule')
+                if not notif_schedule is None:
+                    code += render_text(self.get_code('schedule'), schedule_args=self._schedule_args(notif_schedule))
 
             return {'init': init_code, 'code': code}
 
@@ -109,6 +128,21 @@ class NotificationsFunctional:
             sys.exit(1)
 
 
+    def _schedule_args(self, schedule:dict) -> str:
+        '''Converts the trigger launch parameters into the text of the add_trigger arguments'''
+
+        allowed = ('interval', 'cron', 'jitter', 'args', 'kwargs', 'name', 'stop_on_result', 'run_now')
+
+        args = []
+        for key in schedule:
+            if key in allowed:
+                args.append(f'{key} = {schedule[key]!r}')
+            else:
+                print(f'WARNING: Unknown trigger parameter "{key}" was skipped')
+
+        return ', '.join(args)
+
+
     def get_code(self, code_id):
         '''Get the code from the database'''
 
@@ -156,6 +190,8 @@ class MotherBot:
         launch_сode:str (optional) - adds the startup code (if __name__ == '__main__': ...)
         init_args: List[*args, **kwargs] (optional) - parameters of the __init__ function.
                 The first element of the list is a list of variables, the second element is a dictionary of variables and default values.
+        send_only:bool (optional) - the bot only sends notifications: it starts faster, because telebot is not imported (see notify.NotifyApi).
+                It is not used if init_code is specified
         '''
 
         class_name = kwargs.get('class_name')
@@ -184,28 +220,29 @@ class MotherBot:
             modules = ''
             print('WARNING: Invalid data type, modules were not imported')
 
+        model = BotModel(class_name, class_doc, modules)
+
         #Init_code
         init_code = kwargs.get('init_code')
         if init_code is None:
-            init_code = self.notifications.get_code('def_init')
+            init_code = self.notifications.get_code('def_init_send_only' if kwargs.get('send_only') else 'def_init')
         else:
             init_code = self._format_code(init_code, 4)
 
-        init_code += '\n\n'
+        model.init_code.append(init_code + '\n\n')
 
         #init args
         init_args = kwargs.get('init_args', [[], {}])
-        init_args_text = ', '.join(['self', 'token'] + init_args[0])
+        for name in init_args[0]:
+            model.add_init_arg(name)
 
         for key in init_args[1]:
-            default = init_args[1][key]
-            init_args_text += f', {key} = {default}'
+            model.add_init_arg(key, init_args[1][key])
 
-        code = ''
         if 0 in types:
             additional_code = self.notifications.functional(**kwargs)
-            init_code += additional_code['init']
-            code += additional_code['code']
+            model.init_code.append(additional_code['init'])
+            model.code.append(additional_code['code'])
 
         if 1 in types:
             pass
@@ -213,27 +250,211 @@ class MotherBot:
         if 2 in types:
             pass
 
-        class_code = self.notifications.get_code('code_start').format(modules=modules, class_name=class_name, class_doc=class_doc, init_code=init_code, init_args=init_args_text)
-        class_code += code
-
         launch_сode = kwargs.get('launch_сode')
         if not launch_сode is None:
-            launch_сode = self._format_code(launch_сode, 4)
-            class_code += self.notifications.get_code('launch').format(own_code=launch_сode)
+            model.launch_code = self._format_code(launch_сode, 4)
 
-        with open('bots/' + file_name + '.py', 'w', encoding='utf-8') as file:
-            file.write(class_code)
+        path = 'bots/' + file_name + '.py'
+        CodeEmitter(self.notifications.get_code).emit(model, path)
+        self._check_syntax(path)
+
+
+    def _check_syntax(self, path:str) -> None:
+        '''Checks that the created file is valid python code (own code of the user can contain errors)'''
+
+        with open(path, 'r', encoding='utf-8') as file:
+            source = file.read()
+
+        try:
+            ast.parse(source, path)
+        except SyntaxError as err:
+            print(f'WARNING: The created bot {path} contains an error in line {err.lineno}: {err.msg}')
 
 
     def _format_code(self, unformatted_code:str, spaces:int) -> str:
         '''Adds the specified number of spaces to each line of code'''
 
-        code = ''
-        for line in unformatted_code.split('\n'):
-            code_line = ' '*spaces + line
-            code += code_line.rstrip() + '\n'
+        return ''.join(indent_lines(unformatted_code, spaces))
+
+
+class BotModel:
+    '''
+    Structured model of the bot being created: MotherBot.create_bot fills it, CodeEmitter writes it to the file
+    ----------------------
+    methods:
+       add_init_arg - Add a parameter of the __init__ function, duplicates are skipped
+       init_args_text - Parameters of the __init__ function in the form of code
+    '''
+
+    def __init__(self, class_name:str, class_doc:str, modules:str = ''):
+        '''
+        class_name:str - the name of the class
+        class_doc:str - class description
+        modules:str - imports of the modules in the form of code
+        '''
+
+        self.class_name = class_name
+        self.class_doc = class_doc
+        self.modules = modules
+
+        self.init_args = ['self', 'token'] #parameters without default values
+        self.init_defaults = {} #parameter -> default value in the form of code
+        self.var_args = None #*args
+        self.var_kwargs = None #**kwargs
+        self.init_code = [] #blocks of the __init__ code
+        self.code = [] #blocks of the methods
+        self.launch_code = None
+
+
+    def add_init_arg(self, name:str, default = _NO_DEFAULT) -> bool:
+        '''
+        Add a parameter of the __init__ function. Returns False if it was skipped
+        ----------------------
+        name:str - the name of the parameter, *args and **kwargs are allowed (one of each, without a default value)
+        default: - default value, it is inserted into the code as it is (str(default))
+        '''
+
+        stars = len(name) - len(name.lstrip('*'))
+        if stars > 2 or not name.lstrip('*').isidentifier():
+            print(f'WARNING: Invalid parameter name "{name}" was skipped')
+            return False
+
+        if name.lstrip('*') in self.init_args or name.lstrip('*') in self.init_defaults or name.lstrip('*') in (self.var_args, self.var_kwargs):
+            #self and token are always there, it is not a mistake to list them
+            if name not in ('self', 'token'):
+                print(f'WARNING: Duplicate parameter "{name}" was skipped')
+            return False
+
+        if stars:
+            if default is not _NO_DEFAULT or (self.var_args if stars == 1 else self.var_kwargs) is not None:
+                print(f'WARNING: Parameter "{name}" was skipped: there can be only one {"*" * stars} parameter, without a default value')
+                return False
+
+            if stars == 1:
+                self.var_args = name[1:]
+            else:
+                self.var_kwargs = name[2:]
+
+        elif default is _NO_DEFAULT:
+            self.init_args.append(name)
+        else:
+            self.init_defaults[name] = default
+
+        return True
+
+
+    def init_args_text(self) -> str:
+        '''Parameters of the __init__ function in the form of code, in the order required by python: positional, *args, with defaults, **kwargs'''
+
+        args = list(self.init_args)
+        if self.var_args is not None:
+            args.append('*' + self.var_args)
+
+        for key in self.init_defaults:
+            args.append(f'{key} = {self.init_defaults[key]}')
+
+        if self.var_kwargs is not None:
+            args.append('**' + self.var_kwargs)
+
+        return ', '.join(args)
+
+
+class CodeEmitter:
+    '''
+    Writes BotModel to the file piece by piece through a buffered writer, the whole code is not assembled in memory
+    ----------------------
+    methods:
+       emit - Write the bot to the file
+       chunks - Pieces of the code of the bot in order
+    '''
+
+    def __init__(self, get_code, buffer_size:int = 64 * 1024):
+        '''
+        get_code: function - returns the fragment of the code by its id (NotificationsFunctional.get_code)
+        buffer_size:int - size of the buffer of the file
+        '''
+
+        self.get_code = get_code
+        self.buffer_size = buffer_size
+
+
+    def emit(self, model:BotModel, path:str) -> None:
+        '''Write the bot to the file'''
+
+        with open(path, 'w', encoding='utf-8', buffering=self.buffer_size) as file:
+            file.writelines(self.chunks(model))
+
+
+    def chunks(self, model:BotModel) -> Iterator[str]:
+        '''Pieces of the code of the bot in order'''
+
+        yield from render(self.get_code('code_start'), modules=model.modules, class_name=model.class_name, class_doc=model.class_doc,
+                          init_args=model.init_args_text(), init_code=model.init_code)
+        yield from model.code
+
+        if model.launch_code is not None:
+            yield from render(self.get_code('launch'), own_code=model.launch_code)
+
+
+def render(template:str, **values) -> Iterator[str]:
+    '''
+    Substitutes the values into the placeholders {name} of the fragment. Unlike str.format, other braces are left as they are,
+    and the substituted code is not parsed again, so braces in the code of the user do not break anything
+    ----------------------
+    template:str - the fragment
+    values: - str or iterable of str (they are given out piece by piece)
+    '''
+
+    position = 0
+    for match in _PLACEHOLDER.finditer(template):
+        name = match.group(1)
+        if name not in values:
+            continue
+
+        yield template[position:match.start()]
+
+        value = values[name]
+        if isinstance(value, str):
+            yield value
+        else:
+            yield from value
+
+        position = match.end()
+
+    yield template[position:]
+
+
+def render_text(template:str, **values) -> str:
+    '''The same as render, but returns the text'''
+
+    return ''.join(render(template, **values))
+
+
+def indent_lines(unformatted_code:str, spaces:int) -> Iterator[str]:
+    '''Lines of the code with the specified number of spaces at the beginning'''
+
+    indent = ' ' * spaces
+    for line in unformatted_code.split('\n'):
+        yield (indent + line).rstrip() + '\n'
+
+
+def _assigned_attributes(code:str) -> set:
+    '''Names of the attributes of self that the code assigns (self.users = ...). Empty if the code is not valid'''
+
+    if not code:
+        return set()
+
+    try:
+        tree = ast.parse(textwrap.dedent(code))
+    except SyntaxError:
+        return set()
+
+    attributes = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute) and isinstance(node.ctx, ast.Store) and isinstance(node.value, ast.Name) and node.value.id == 'self':
+            attributes.add(node.attr)
 
-        return code
+    return attributes
 
 
 def _new_loger(name, path):
@@ -268,10 +489,11 @@ def test_notif_bot(mother_bot):
 
     init_code = "    '''\n    token:str - bot token received from https://t.me/BotFather\n    userslist[str] - users tokens received from https://t.me/getmyid_bot\n    '''\n\n    super().__init__(token)\n    self.users = users\n\n    self.last_changes = {}"
     notif_func = 'last_change = self.last_changes.get(filename)\n\nif not os.path.exists(filename):\n    if last_change is None:\n        msg = f\'🤔 File {filename} does not exist\'\n    else:\n        msg = f\'😱 Someone deleted or rename your file "{filename}"!\'\n        self.last_changes.pop(filename)\n\n    for user in self.users:\n        self.api.send_message(user, msg)\n\n    return 1\n\nif last_change is None:\n    self.last_changes[filename] = os.path.getmtime(filename)\n\n    text_time = time.ctime(self.last_changes[filename])\n    msg = f\'Starting to monitor the file "{filename}". Last updated {text_time}.\'\n\n    for user in self.users:\n        self.api.send_message(user, msg)\n\nelse:\n    change = os.path.getmtime(filename)\n\n    if last_change != change:\n        self.last_changes[filename] = change\n\n        text_time = time.ctime(self.last_changes[filename])\n        msg = f\'❗️Viu-viu! {text_time} someone touched your file {filename}!❗️\'\n\n        for user in self.users:\n            self.api.send_message(user, msg)\n\nreturn 0\n'
-    launch_сode = "token = 'TOKEN'\nusers = ['571315321'] #usersID\ntelegram = NotificationsBot(token, users)\nwhile True:\n    status_code = telegram.notificationTrigger('data.txt')\n    if status_code:\n        print(f'The test is over with the status code {status_code}')\n        break\n    time.sleep(1)\n"
+    launch_сode = "token = 'TOKEN'\nusers = ['571315321'] #usersID\ntelegram = NotificationsBot(token, users)\ntelegram.start_notifications(separate_thread=False)\n\nstatus_code = telegram.trigger_stats()['notificationTrigger']['last_result']\nprint(f'The test is over with the status code {status_code}')\n"
 
     mother_bot.create_bot('my_bot', [0], modules=['os', 'time'], class_name='NotificationsBot', class_doc='\n    A class showing how to create a bot that sends notifications to specified users.\n\n    We will receive a notification when someone changes our file. (Can be used to check the database for changes)\n    ',
-                          init_code=init_code, init_args=[['token', 'users'], {}], notif_func=notif_func, notif_func_args=[['filename'], {}], launch_сode=launch_сode)
+                          init_code=init_code, init_args=[['token', 'users'], {}], notif_func=notif_func, notif_func_args=[['filename'], {}],
+                          notif_schedule={'interval': 1, 'args': ['data.txt'], 'stop_on_result': True, 'run_now': True}, launch_сode=launch_сode)
 
 
 if __name__ == '__main__':
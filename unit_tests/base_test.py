@@ -142,6 +142,53 @@ class General(BaseTest):
         self.assertEqual(code, self._get_code('empty') + self._get_code('launch'))
 
 
+    def test_send_only(self):
+        '''A bot that only sends notifications does not need telebot'''
+
+        self.mother_bot.create_bot('bot_1', [], class_name='TestBot', send_only=True)
+
+        with open(self.test_files[0]) as f:
+            code = f.read()
+
+        self.assertIn('        super().__init__(token, send_only = True)\n', code)
+
+
+    def test_init_args(self):
+        '''Duplicate parameters of __init__ are skipped, the own code of __init__ is not overwritten by the defaults'''
+
+        init_code = "super().__init__(token)\nself.users = users"
+        self.mother_bot.create_bot('bot_2', [0], init_code=init_code, init_args=[['token', 'users', 'users'], {'users': [], 'mode': "'a'"}])
+
+        with open(self.test_files[1]) as f:
+            code = f.read()
+
+        self.assertIn("    def __init__(self, token, users, mode = 'a'):\n", code)
+        self.assertNotIn('self.users = []', code)
+
+
+    def test_init_args_order(self):
+        '''*args and **kwargs are placed where python allows them, whatever the order of input'''
+
+        model = bots_creator.BotModel('Bot', '')
+        for name in ('**kwargs', '*args', 'users'):
+            model.add_init_arg(name)
+        model.add_init_arg('mode', 1)
+
+        self.assertFalse(model.add_init_arg('**options'))
+        self.assertFalse(model.add_init_arg('*rest', 1))
+        self.assertFalse(model.add_init_arg('args'))
+        self.assertEqual(model.init_args_text(), 'self, token, users, *args, mode = 1, **kwargs')
+        compile(f'def __init__({model.init_args_text()}): pass', 'bot', 'exec')
+
+
+    def test_render(self):
+        '''Only the known placeholders are replaced, other braces remain'''
+
+        chunks = bots_creator.render("d = {'a': 1}\n{own_code}{unknown}", own_code=(line for line in ['x = {}\n', 'y = 2\n']))
+        self.assertEqual(''.join(chunks), "d = {'a': 1}\nx = {}\ny = 2\n{unknown}")
+
+
+
 class Notifications(BaseTest):
     '''A class for testing the creation of bots that send notifications'''
 
@@ -195,5 +242,14 @@ class Notifications(BaseTest):
         self.assertEqual(code['code'], self._get_code('notif_func_res'))
 
 
+    def test_notif_schedule(self):
+        '''Testing the launch of notifications by the scheduler of the bot'''
+
+        code = self.mother_bot.notifications.functional(notif_func=self._get_code('notif_function'), notif_schedule={'interval': 5, 'args': ['data.txt'], 'jitter': 1})
+        self.assertIn("self.add_trigger(self.notificationTrigger, interval = 5, args = ['data.txt'], jitter = 1)\n", code['code'])
+        self.assertTrue(code['code'].startswith('    def notificationTrigger(self):'))
+
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,1110 @@
+# -*- coding: utf-8 -*-
+'''Testing the helper modules of the bots that work without telegram'''
+
+import os
+import sys
+import time
+import sqlite3
+import datetime
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+BOTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bots')
+sys.path.append(BOTS_DIR)
+import backlog
+import scheduler
+import tail_follow
+import media_cache
+import outbound
+import lite_update
+import profiler
+import dedup
+import supervisor
+import notify
+import long_poll
+import meta_cache
+import circuit
+import dialog_table
+
+
+class DialogTable(unittest.TestCase):
+    '''A class for testing the table of answers'''
+
+    def test_find(self):
+        '''The earlier answer wins, case is taken into account only where it is needed'''
+
+        table = dialog_table.DialogTable.from_rows([
+            ('hi', 'hello|Hi', 'Hi!'),
+            ('case', 'Hi|BIG', 'Case', 1),
+        ])
+
+        self.assertEqual(table.find('HELLO'), 'Hi!')
+        self.assertEqual(table.find('Hi'), 'Hi!')
+        self.assertEqual(table.find('BIG'), 'Case')
+        self.assertIsNone(table.find('big'))
+        self.assertEqual(table.find('big', 'default'), 'default')
+
+
+    def test_copy_on_write(self):
+        '''Changes create a new table, the old one stays the same'''
+
+        table = dialog_table.DialogTable()
+        new_table = table.updated('1', {'phrases': ['a'], 'answer': 'A', 'edit_case': True})
+
+        self.assertIsNone(table.find('a'))
+        self.assertEqual(new_table.find('a'), 'A')
+        self.assertIsNone(new_table.without('1').find('a'))
+
+
+    def test_patched_like_rebuilt(self):
+        '''A table changed answer by answer finds the same as a table built from the same answers'''
+
+        import random
+        rand = random.Random(1)
+        phrases = ['a', 'b', 'c', 'd', 'A', 'B']
+        table = dialog_table.DialogTable()
+
+        for i in range(300):
+            answer_id = str(rand.randrange(8))
+            if rand.random() < 0.3:
+                table = table.without(answer_id)
+            else:
+                edit_case = rand.random() < 0.5
+                remark = {'phrases': [phrase.lower() if edit_case else phrase for phrase in rand.sample(phrases, 2)],
+                          'answer': f'{answer_id}-{i}', 'edit_case': edit_case}
+                table = table.updated(answer_id, remark)
+
+            rebuilt = dialog_table.DialogTable(table.remarks)
+            for phrase in phrases:
+                self.assertEqual(table.find(phrase), rebuilt.find(phrase))
+
+
+    def test_sqlite(self):
+        '''Loading answers from the database'''
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'answers.sqlite')
+            connect = sqlite3.connect(path)
+            connect.execute('CREATE TABLE answers (answer_id TEXT, phrases TEXT, answer TEXT, consider_case INTEGER)')
+            connect.execute('INSERT INTO answers VALUES ("1", "yo|hey", "Yo!", 0)')
+            connect.commit()
+            connect.close()
+
+            table = dialog_table.DialogTable.from_sqlite(path)
+
+        self.assertEqual(table.find('Hey'), 'Yo!')
+
+
+def _update(update_id, date, chat_id):
+    '''An update with a message, like the one telebot creates'''
+
+    message = SimpleNamespace(date=date, edit_date=None, chat=SimpleNamespace(id=chat_id))
+    return SimpleNamespace(update_id=update_id, message=message)
+
+
+class Backlog(unittest.TestCase):
+    '''A class for testing the processing of accumulated updates'''
+
+    def test_offset_store(self):
+        '''The saved offset is read after a restart'''
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'offset')
+
+            self.assertEqual(backlog.OffsetStore(path).load(), 0)
+            backlog.OffsetStore(path).save(42)
+            self.assertEqual(backlog.OffsetStore(path).load(), 42)
+
+
+    def test_max_age(self):
+        '''Old accumulated updates are skipped, live ones are not'''
+
+        policy = backlog.BacklogPolicy(max_age=60)
+        updates = [_update(1, policy.started - 600, 1), _update(2, policy.started - 10, 1), _update(3, policy.started + 1, 1)]
+
+        result = policy.filter(updates)
+
+        self.assertEqual([update.update_id for update in result], [2, 3])
+        self.assertEqual(policy.stats['skipped_old'], 1)
+
+
+    def test_latest_per_chat(self):
+        '''Only the last accumulated message of each chat remains'''
+
+        policy = backlog.BacklogPolicy(latest_per_chat=True)
+        updates = [_update(1, policy.started - 3, 1), _update(2, policy.started - 2, 2), _update(3, policy.started - 1, 1)]
+
+        result = policy.filter(updates)
+
+        self.assertEqual([update.update_id for update in result], [2, 3])
+        self.assertEqual(policy.stats['skipped_replaced'], 1)
+
+
+    def test_latest_per_chat_batches(self):
+        '''A backlog longer than one answer of telegram still gives one message per chat'''
+
+        policy = backlog.BacklogPolicy(latest_per_chat=True)
+        policy.batch_limit = 2
+        old = policy.started - 10
+
+        self.assertEqual(policy.filter([_update(1, old, 1), _update(2, old, 2)]), [])
+        self.assertEqual(policy.filter([_update(3, old, 1), _update(4, old, 1)]), [])
+        result = policy.filter([_update(5, policy.started + 1, 3)])
+
+        self.assertEqual([update.update_id for update in result], [2, 4, 5])
+        self.assertEqual(policy.stats['skipped_replaced'], 2)
+
+        #The backlog ends with an empty answer
+        policy.filter([_update(6, old, 4), _update(7, old, 4)])
+        self.assertEqual([update.update_id for update in policy.filter([])], [7])
+
+
+    def test_allowed_updates(self):
+        '''Handlers of an unknown type of updates make the bot receive everything'''
+
+        api = SimpleNamespace(message_handlers=[print], callback_query_handlers=[], state_handlers=None)
+        self.assertEqual(backlog.allowed_updates(api), ['message'])
+
+        api.managed_bot_handlers = [print]
+        self.assertIsNone(backlog.allowed_updates(api))
+        self.assertEqual(backlog.unknown_handlers(api), ['managed_bot_handlers'])
+
+
+class Scheduler(unittest.TestCase):
+    '''A class for testing the scheduler of triggers'''
+
+    def test_timer_wheel(self):
+        '''Each trigger expires exactly at its tick, including those beyond the range of the wheel'''
+
+        wheel = scheduler.TimerWheel(slots=4, levels=3)
+        ticks = {}
+        for tick in range(0, 300, 7):
+            trigger = scheduler.Trigger(print, interval=1)
+            wheel.add(trigger, tick)
+            ticks[trigger] = max(tick, 1)
+
+        expired = {}
+        for _ in range(300):
+            for trigger in wheel.advance():
+                expired[trigger] = wheel.current
+
+        self.assertEqual(expired, ticks)
+
+
+    def test_cron(self):
+        '''The next launch time by cron-style schedule'''
+
+        cron = scheduler.CronSpec('30 9 * * 1-5')
+        friday = datetime.datetime(2024, 5, 10, 10, 0).timestamp()
+
+        self.assertEqual(datetime.datetime.fromtimestamp(cron.next_after(friday)), datetime.datetime(2024, 5, 13, 9, 30))
+        self.assertRaises(ValueError, scheduler.CronSpec, '* * *')
+
+
+    def test_cron_launches(self):
+        '''A cron trigger that starts late and works for a while fires once a minute, without overruns'''
+
+        from unittest import mock
+
+        clock = SimpleNamespace(now=1000.0)
+        offset = datetime.datetime(2024, 5, 10, 22, 15, 30).timestamp() - clock.now
+        fake_time = SimpleNamespace(monotonic=lambda: clock.now, time=lambda: clock.now + offset)
+
+        def work():
+            clock.now += 0.3
+
+        with mock.patch.object(scheduler, 'time', fake_time):
+            tasks = scheduler.Scheduler(tick=0.1)
+            trigger = tasks.add(work, cron='* * * * *')
+
+            launches = []
+            for i in range(9):
+                clock.now = trigger.due + 0.05
+                launches.append(datetime.datetime.fromtimestamp(clock.now + offset))
+                tasks._launch(trigger)
+
+        self.assertEqual([launch.minute for launch in launches], list(range(16, 25)))
+        self.assertTrue(all(launch.second == 0 for launch in launches))
+        self.assertEqual(trigger.overruns, 0)
+
+
+    def test_jitter_does_not_add_up(self):
+        '''Jitter delays each launch, but the period stays equal to the interval'''
+
+        from unittest import mock
+
+        clock = SimpleNamespace(now=0.0)
+        fake_time = SimpleNamespace(monotonic=lambda: clock.now, time=lambda: clock.now)
+
+        with mock.patch.object(scheduler, 'time', fake_time):
+            tasks = scheduler.Scheduler(tick=0.1)
+            trigger = tasks.add(lambda: None, interval=60, jitter=10)
+
+            for i in range(100):
+                clock.now = trigger.due + trigger.delay
+                tasks._launch(trigger)
+
+        self.assertAlmostEqual(trigger.due, 6060.0)
+        self.assertLessEqual(trigger.delay, 10)
+        self.assertEqual(trigger.overruns, 0)
+
+
+    def test_stop_on_result(self):
+        '''The trigger stops after a non-zero result and the scheduler finishes'''
+
+        calls = []
+        tasks = scheduler.Scheduler(tick=0.01)
+        tasks.add(lambda: calls.append(1) or len(calls) >= 3, interval=0.01, name='counter', stop_on_result=True, run_now=True)
+        tasks.start(separate_thread=False)
+
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(tasks.stats()['counter']['runs'], 3)
+
+
+class TailFollow(unittest.TestCase):
+    '''A class for testing the following of growing files'''
+
+    def test_new_lines(self):
+        '''Only appended lines are read, the incomplete line waits'''
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'log.txt')
+            with open(path, 'w') as f:
+                f.write('old line\n')
+
+            tail = tail_follow.FileTail(path)
+            with open(path, 'a') as f:
+                f.write('first\nsec')
+
+            self.assertEqual(tail.read_lines(), ['first'])
+
+            with open(path, 'a') as f:
+                f.write('ond\n')
+
+            self.assertEqual(tail.read_lines(), ['second'])
+            tail.close()
+
+
+    def test_rotation_and_truncation(self):
+        '''After rotation the new file is read from the beginning, after truncation too'''
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'log.txt')
+            with open(path, 'w') as f:
+                f.write('a\n')
+
+            tail = tail_follow.FileTail(path, from_start=True)
+            self.assertEqual(tail.read_lines(), ['a'])
+
+            with open(path, 'a') as f:
+                f.write('b\n')
+            os.rename(path, path + '.1')
+            with open(path, 'w') as f:
+                f.write('c\n')
+
+            self.assertEqual(tail.read_lines(), ['b', 'c'])
+            self.assertEqual(tail.rotations, 1)
+
+            with open(path, 'a') as f:
+                f.write('long line\n')
+            self.assertEqual(tail.read_lines(), ['long line'])
+
+            with open(path, 'w') as f:
+                f.write('d\n')
+
+            self.assertEqual(tail.read_lines(), ['d'])
+            self.assertEqual(tail.truncations, 1)
+            tail.close()
+
+
+    def test_rotation_max_bytes(self):
+        '''The rest of the rotated file is also read by max_bytes, then the new file'''
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'log.txt')
+            with open(path, 'w') as f:
+                f.write('')
+
+            tail = tail_follow.FileTail(path, from_start=True)
+
+            with open(path, 'a') as f:
+                f.write('1\n2\n3\n')
+            os.rename(path, path + '.1')
+            with open(path, 'w') as f:
+                f.write('4\n')
+
+            self.assertEqual(tail.read_lines(max_bytes=4), ['1', '2'])
+            self.assertEqual(tail.rotations, 0)
+            self.assertEqual(tail.read_lines(max_bytes=4), ['3', '4'])
+            self.assertEqual(tail.rotations, 1)
+            tail.close()
+
+
+    def test_notifier(self):
+        '''Matching lines are sent in batches, positions are saved'''
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'log.txt')
+            state_file = os.path.join(tmp, 'state.json')
+            with open(path, 'w') as f:
+                f.write('INFO ok\nERROR one\nWARN two\nERROR three\n')
+
+            messages = []
+            notifier = tail_follow.TailNotifier([path], ['ERROR', 'WARN'], messages.append, state_file, from_start=True, batch_lines=2)
+
+            self.assertEqual(notifier.check(), 3)
+            self.assertEqual(messages, ['log.txt:\nERROR one\nWARN two', 'log.txt:\nERROR three'])
+            notifier.tails[0].close()
+
+            restarted = tail_follow.TailNotifier([path], ['ERROR'], messages.append, state_file, from_start=True)
+            self.assertEqual(restarted.check(), 0)
+            restarted.tails[0].close()
+
+
+class MediaCache(unittest.TestCase):
+    '''A class for testing the cache of uploaded files'''
+
+    def test_file_id_cache(self):
+        '''The file_id is found by the contents of the file and is saved between restarts'''
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_file = os.path.join(tmp, 'file_ids.json')
+            path = os.path.join(tmp, 'report.pdf')
+            copy_path = os.path.join(tmp, 'copy.pdf')
+            for file_path in (path, copy_path):
+                with open(file_path, 'wb') as f:
+                    f.write(b'%PDF data')
+
+            cache = media_cache.FileIdCache(cache_file)
+            self.assertIsNone(cache.get(path, 'document'))
+            cache.put(path, 'document', 'FILE_ID')
+
+            restarted = media_cache.FileIdCache(cache_file)
+            self.assertEqual(restarted.get(copy_path, 'document'), 'FILE_ID')
+            self.assertIsNone(restarted.get(copy_path, 'photo'))
+
+
+    def test_file_id_of(self):
+        '''The largest size of the photo is taken'''
+
+        message = SimpleNamespace(photo=[SimpleNamespace(file_id='small'), SimpleNamespace(file_id='big')])
+        self.assertEqual(media_cache.file_id_of(message, 'photo'), 'big')
+
+
+    def test_file_id_error(self):
+        '''Only errors of the file_id itself make the file upload again'''
+
+        def error(code, description):
+            return SimpleNamespace(error_code=code, description=description)
+
+        self.assertTrue(media_cache.is_file_id_error(error(400, 'Bad Request: wrong file identifier/HTTP URL specified')))
+        self.assertTrue(media_cache.is_file_id_error(error(400, 'Bad Request: FILE_REFERENCE_EXPIRED')))
+        self.assertFalse(media_cache.is_file_id_error(error(403, 'Forbidden: bot was blocked by the user')))
+        self.assertFalse(media_cache.is_file_id_error(error(400, 'Bad Request: chat not found')))
+
+
+    def test_streamed_upload(self):
+        '''The file goes to requests as a stream with a known length, and the body is a correct multipart/form-data'''
+
+        import email
+        import telebot
+        import basic_bot
+        from unittest import mock
+
+        sent = {}
+
+        def post(url, data, headers, timeout, proxies):
+            prepared = telebot.apihelper.requests.Request('POST', url, data=data, headers=headers).prepare()
+            sent.update(url=url, streamed=prepared.body is data, length=prepared.headers['Content-Length'], content_type=headers['Content-Type'])
+            sent['body'] = b''.join(data)
+            return SimpleNamespace(status_code=200, json=lambda: {'ok': True, 'result': {
+                'message_id': 1, 'date': 0, 'chat': {'id': 5, 'type': 'private'}, 'document': {'file_id': 'ID', 'file_unique_id': 'U'}}})
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'report.txt')
+            with open(path, 'wb') as f:
+                f.write(b'x' * 200000)
+
+            bot = basic_bot.TelegramBotParent('1:TOKEN')
+            with mock.patch('telebot.apihelper._get_req_session', return_value=SimpleNamespace(post=post)):
+                message = bot._upload('document', 5, path, caption='Report')
+
+        self.assertEqual(media_cache.file_id_of(message, 'document'), 'ID')
+        self.assertTrue(sent['url'].endswith('/bot1:TOKEN/sendDocument'))
+        self.assertTrue(sent['streamed'])
+        self.assertEqual(int(sent['length']), len(sent['body']))
+
+        parsed = email.message_from_bytes(f'''Content-Type: {sent['content_type']}\r\n\r\n'''.encode() + sent['body'])
+        parts = {part.get_param('name', header='content-disposition'): part for part in parsed.get_payload()}
+        self.assertEqual(parts['chat_id'].get_payload(), '5')
+        self.assertEqual(parts['caption'].get_payload(), 'Report')
+        self.assertEqual(parts['document'].get_filename(), 'report.txt')
+        self.assertEqual(parts['document'].get_payload(decode=True), b'x' * 200000)
+
+
+class Outbound(unittest.TestCase):
+    '''A class for testing the priority lanes of outgoing requests'''
+
+    def test_interactive_ahead_of_bulk(self):
+        '''An answer to the user overtakes the broadcast that is already in the queue'''
+
+        order = []
+        sender = outbound.OutboundScheduler(rate=1000, burst=1, workers=1)
+
+        futures = [sender.submit(order.append, f'bulk {i}', lane='bulk') for i in range(50)]
+        sender.call(order.append, 'answer', lane='interactive')
+        for future in futures:
+            future.result()
+        sender.stop()
+
+        self.assertLess(order.index('answer'), 10)
+        stats = sender.stats()
+        self.assertEqual(stats['bulk']['sent'], 50)
+        self.assertEqual(stats['interactive']['sent'], 1)
+
+
+    def test_errors(self):
+        '''The exception of the request is returned to the caller'''
+
+        sender = outbound.OutboundScheduler(workers=1)
+
+        self.assertRaises(ZeroDivisionError, sender.call, lambda: 1 / 0)
+        self.assertEqual(sender.stats()['normal']['errors'], 1)
+        sender.stop()
+
+
+class LiteUpdate(unittest.TestCase):
+    '''A class for testing lite messages'''
+
+    raw = {'update_id': 10, 'message': {'message_id': 3, 'date': 1, 'text': '/start@my_bot now',
+                                        'chat': {'id': 7, 'type': 'group'}, 'from': {'id': 9, 'first_name': 'A'}}}
+
+    def test_fields(self):
+        '''Fields are read like in telebot objects'''
+
+        message = lite_update.LiteMessage(self.raw['message'])
+
+        self.assertEqual(message.from_user.id, 9)
+        self.assertEqual(message.chat.id, 7)
+        self.assertEqual(message.id, 3)
+        self.assertEqual(message.content_type, 'text')
+        self.assertIsNone(message.photo)
+
+
+    def test_parse_updates(self):
+        '''Only messages for lite handlers are not parsed fully'''
+
+        handlers = lite_update.LiteHandlers()
+        handler = lambda message: None
+        handlers.add(handler, ['text'], commands=['start'])
+
+        other = {'update_id': 11, 'callback_query': {}}
+        updates = lite_update.parse_updates([self.raw, other], handlers, lambda raw: raw)
+
+        self.assertIsInstance(updates[0], lite_update.LiteUpdate)
+        self.assertIs(updates[0].handler, handler)
+        self.assertIsNone(updates[0].edited_message)
+        self.assertIs(updates[1], other)
+
+
+class Profiler(unittest.TestCase):
+    '''A class for testing the sampling profiler'''
+
+    def test_collapsed_stacks(self):
+        '''The stacks of the sampled calls are collected under the label of the handler'''
+
+        def slow_part():
+            end = time.monotonic() + 0.05
+            while time.monotonic() < end:
+                pass
+
+        tracer = profiler.Profiler(sample_rate=1.0, interval=0.001)
+        handler = tracer.wrap(lambda message: slow_part(), 'handler')
+
+        handler('not profiled')
+        self.assertEqual(tracer.collapsed(), '')
+
+        tracer.enable()
+        handler('profiled')
+        tracer.disable()
+
+        self.assertTrue(tracer.collapsed().startswith('handler;<lambda> '))
+        self.assertIn(';slow_part (bots_test.py:', tracer.collapsed())
+        self.assertEqual(tracer.stats['sampled_calls'], 1)
+
+
+class Dedup(unittest.TestCase):
+    '''A class for testing the deduplication of sent messages'''
+
+    def test_reserve_and_release(self):
+        '''A key is reserved once, a released key can be reserved again'''
+
+        store = dedup.DedupStore()
+        key = dedup.make_key('571315321', 'File changed', 'data.txt:1700000000')
+
+        self.assertTrue(store.reserve(key))
+        self.assertFalse(store.reserve(key))
+        store.release(key)
+        self.assertTrue(store.reserve(key))
+        self.assertEqual(store.stats, {'sent': 1, 'suppressed': 1, 'released': 1})
+
+
+    def test_restart_and_limits(self):
+        '''Keys are saved between restarts, old keys are deleted'''
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'dedup.sqlite')
+
+            store = dedup.DedupStore(path, max_size=2)
+            for key in ('a', 'b', 'c'):
+                store.reserve(key)
+            store._connect.close()
+
+            restarted = dedup.DedupStore(path, max_size=2)
+            self.assertNotIn('a', restarted)
+            self.assertFalse(restarted.reserve('c'))
+            restarted._connect.close()
+
+
+        expired = dedup.DedupStore(ttl=-1)
+        expired.reserve('d')
+        self.assertTrue(expired.reserve('d'))
+
+
+    def test_not_delivered(self):
+        '''The key is released only when telegram surely did not accept the message'''
+
+        import socket
+        import urllib.error
+        import requests
+        import urllib3
+
+        def telegram_error(code):
+            return SimpleNamespace(error_code=code)
+
+        refused = requests.ConnectionError(urllib3.exceptions.MaxRetryError(None, 'url', urllib3.exceptions.NewConnectionError(None, 'refused')))
+
+        self.assertTrue(dedup.not_delivered(telegram_error(403)))
+        self.assertTrue(dedup.not_delivered(telegram_error(429)))
+        self.assertTrue(dedup.not_delivered(refused))
+        self.assertTrue(dedup.not_delivered(requests.exceptions.ConnectTimeout()))
+        self.assertTrue(dedup.not_delivered(urllib.error.URLError(socket.gaierror())))
+        self.assertFalse(dedup.not_delivered(telegram_error(502)))
+        self.assertFalse(dedup.not_delivered(requests.exceptions.ReadTimeout()))
+        self.assertFalse(dedup.not_delivered(requests.ConnectionError('Connection aborted')))
+        self.assertFalse(dedup.not_delivered(socket.timeout()))
+
+
+    def test_reserve_many(self):
+        '''Keys of a broadcast are reserved with one commit, duplicates are reported for each key'''
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'dedup.sqlite')
+
+            store = dedup.DedupStore(path)
+            statements = []
+            store._connect.set_trace_callback(statements.append)
+
+            self.assertEqual(store.reserve_many(['a', 'b', 'a']), [True, True, False])
+            self.assertEqual(statements.count('COMMIT'), 1)
+            self.assertEqual(store.stats, {'sent': 2, 'suppressed': 1, 'released': 0})
+            store._connect.close()
+
+            restarted = dedup.DedupStore(path)
+            self.assertEqual(restarted.reserve_many(['b', 'c']), [False, True])
+            restarted._connect.close()
+
+
+class Supervisor(unittest.TestCase):
+    '''A class for testing the distribution of bots among worker processes'''
+
+    def test_shard_ring(self):
+        '''Keys are distributed among all nodes, and removing a node moves only its keys'''
+
+        ring = supervisor.ShardRing(['worker-0', 'worker-1', 'worker-2'])
+        placed = {chat: ring.node_for(chat) for chat in range(3000)}
+        self.assertEqual(set(placed.values()), {'worker-0', 'worker-1', 'worker-2'})
+        self.assertEqual(ring.node_for(42), placed[42])
+
+        smaller = supervisor.ShardRing(['worker-0', 'worker-1'])
+        moved = [chat for chat, node in placed.items() if node != 'worker-2' and smaller.node_for(chat) != node]
+        self.assertEqual(moved, [])
+
+
+    def test_chat_of(self):
+        '''All updates of one chat go to one worker'''
+
+        self.assertEqual(supervisor.chat_of({'update_id': 1, 'message': {'chat': {'id': 5}}}), 5)
+        self.assertEqual(supervisor.chat_of({'update_id': 2, 'callback_query': {'from': {'id': 6}, 'message': {'chat': {'id': 7}}}}), 7)
+        self.assertEqual(supervisor.chat_of({'update_id': 3, 'inline_query': {'from': {'id': 8}}}), 8)
+
+
+    def test_remote_sender(self):
+        '''The request of the worker is performed by the supervisor side and the answer returns to the worker'''
+
+        import queue
+        import threading
+        outbox, responses = queue.Queue(), queue.Queue()
+        sender = supervisor._RemoteSender(0, outbox, responses, response_timeout=5)
+        received = []
+
+        def serve():
+            message = outbox.get(timeout=5)
+            received.append(message)
+            #A late answer to the request with the same number from a crashed process is dropped
+            responses.put(((message[2][0] + 1, message[2][1]), ('ok', 500, 'Error', '{"ok": false}')))
+            responses.put((message[2], ('ok', 200, 'OK', '{"ok": true, "result": 1}')))
+
+        server = threading.Thread(target=serve)
+        server.start()
+        response = sender('post', 'https://api.telegram.org/botTOKEN/sendDocument', files={'document': ('a.txt', b'data')})
+        server.join(5)
+
+        self.assertEqual(received[0][:2], ('request', 0))
+        self.assertEqual(received[0][6], {'document': ('a.txt', b'data')})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['result'], 1)
+
+
+    def test_restart(self):
+        '''A crashed worker is restarted with a new process, load_stats shows it'''
+
+        import signal
+
+        workers = supervisor.Supervisor(workers=1, check_interval=0.05)
+        workers.start()
+        try:
+            before = workers.load_stats()['worker-0']
+            self.assertTrue(before['alive'])
+            self.assertEqual(before['restarts'], 0)
+
+            os.kill(before['pid'], signal.SIGKILL)
+
+            for i in range(100):
+                after = workers.load_stats()['worker-0']
+                if after['restarts'] and after['alive']:
+                    break
+                time.sleep(0.05)
+
+            self.assertEqual(after['restarts'], 1)
+            self.assertTrue(after['alive'])
+            self.assertNotEqual(after['pid'], before['pid'])
+        finally:
+            workers.stop()
+
+
+class LazyImport(unittest.TestCase):
+    '''A class for testing that telebot and requests are imported only when they are needed'''
+
+    def test_basic_bot_without_telebot(self):
+        '''Importing basic_bot and sending by a send-only bot do not import telebot'''
+
+        import subprocess
+        code = ('import sys, basic_bot\n'
+                'bot = basic_bot.TelegramBotParent("TOKEN", send_only=True)\n'
+                'print(type(bot.api).__name__, "telebot" in sys.modules, "requests" in sys.modules)')
+        result = subprocess.run([sys.executable, '-c', code], cwd=BOTS_DIR, capture_output=True, text=True)
+        self.assertEqual(result.stdout.split(), ['NotifyApi', 'False', 'False'])
+
+
+    def test_notify_api(self):
+        '''NotifyApi sends the same json as telegram expects'''
+
+        import json
+        from unittest import mock
+
+        class Answer:
+            def __enter__(self):
+                return self
+            def __exit__(self, *args):
+                pass
+            def read(self):
+                return b'{"ok": true, "result": {"message_id": 7}}'
+
+        api = notify.NotifyApi('TOKEN', parse_mode='HTML')
+        with mock.patch('urllib.request.urlopen', return_value=Answer()) as urlopen:
+            message = api.send_message(5, 'text')
+
+        request = urlopen.call_args[0][0]
+        self.assertEqual(message, {'message_id': 7})
+        self.assertTrue(request.full_url.endswith('/botTOKEN/sendMessage'))
+        self.assertEqual(json.loads(request.data), {'chat_id': 5, 'text': 'text', 'parse_mode': 'HTML'})
+
+
+    def test_notify_errors(self):
+        '''Errors of NotifyApi have error_code, even if the body of the answer is not json'''
+
+        import io
+        import urllib.error
+        from unittest import mock
+
+        def error(code, body):
+            return urllib.error.HTTPError('url', code, 'Error', {}, io.BytesIO(body))
+
+        api = notify.NotifyApi('TOKEN')
+        answers = [
+            (error(400, b'{"ok": false, "error_code": 400, "description": "Bad Request: chat not found"}'), 400),
+            (error(502, b'<html>Bad Gateway</html>'), 502),
+            (error(429, b''), 429),
+        ]
+
+        for answer, code in answers:
+            with mock.patch('urllib.request.urlopen', side_effect=answer):
+                with self.assertRaises(notify.TelegramError) as raised:
+                    api.send_message(5, 'text')
+
+            self.assertEqual(raised.exception.error_code, code)
+            self.assertEqual(circuit._is_failure(raised.exception), code != 400)
+            self.assertEqual(meta_cache._is_negative(raised.exception), code == 400)
+
+
+class LongPoll(unittest.TestCase):
+    '''A class for testing the adaptive long polling and batch handlers'''
+
+    def test_adaptive_params(self):
+        '''Empty answers lengthen the timeout, full batches increase the limit, a steady flow gives a pause'''
+
+        polling = long_poll.AdaptivePolling(min_timeout=1, max_timeout=8, min_limit=10, max_limit=40)
+        for i in range(5):
+            polling.observe(0, 1.0)
+        self.assertEqual(polling.params(), (8, 10))
+
+        polling.observe(10, 0.1)
+        polling.observe(20, 0.1)
+        self.assertEqual(polling.params(), (2, 40))
+        self.assertEqual(polling.delay(), 0.0)
+
+        polling.observe(5, 0.1)
+        self.assertFalse(polling.last_full)
+        self.assertGreater(polling.delay(), 0.0)
+        self.assertEqual(polling.stats()['round_trips_per_update'], 8 / 35)
+
+
+    def test_batch_handler(self):
+        '''The batch handler receives all messages of one answer at once'''
+
+        import telebot
+        import basic_bot
+
+        bot = basic_bot.TelegramBotParent('1:TOKEN')
+        bot.api.threaded = False
+
+        batches = []
+        bot.add_batch_listening(batches.append)
+        bot._wrap_process_updates()
+
+        raw = [{'update_id': i, 'message': {'message_id': i, 'date': 0, 'chat': {'id': 1, 'type': 'private'}, 'text': str(i)}} for i in range(3)]
+        bot.api.process_new_updates([telebot.types.Update.de_json(update) for update in raw])
+
+        self.assertEqual([[message.text for message in batch] for batch in batches], [['0', '1', '2']])
+        self.assertEqual(bot.api.last_update_id, 2)
+
+
+    def test_batch_handler_with_lite(self):
+        '''Messages of lite handlers get to the batch handler as objects of telebot, like the others'''
+
+        import telebot
+        import basic_bot
+
+        bot = basic_bot.TelegramBotParent('1:TOKEN')
+        bot.api.threaded = False
+
+        lite, batches = [], []
+        bot.add_listening(lite.append, commands=['start'], lite=True)
+        bot.add_batch_listening(batches.append)
+        bot._wrap_process_updates()
+
+        raw = [{'update_id': i, 'message': {'message_id': i, 'date': 0, 'chat': {'id': 1, 'type': 'private'}, 'text': text}}
+               for i, text in enumerate(['/start', 'hi'])]
+        bot.api.process_new_updates(lite_update.parse_updates(raw, bot.lite_handlers, telebot.types.Update.de_json))
+
+        self.assertIsInstance(lite[0], lite_update.LiteMessage)
+        self.assertEqual([type(message) for message in batches[0]], [telebot.types.Message] * 2)
+        self.assertEqual([message.text for message in batches[0]], ['/start', 'hi'])
+
+
+    def test_allowed_updates(self):
+        '''Lite and batch handlers alone also give the list of allowed updates'''
+
+        import basic_bot
+
+        bot = basic_bot.TelegramBotParent('1:TOKEN')
+        self.assertIsNone(bot._allowed_updates())
+
+        bot.add_listening(print, lite=True)
+        self.assertEqual(bot._allowed_updates(), ['message'])
+
+        bot = basic_bot.TelegramBotParent('1:TOKEN')
+        bot.add_batch_listening(print, ['callback_query'])
+        self.assertEqual(bot._allowed_updates(), ['callback_query'])
+
+        bot.add_keyboard_listening(print)
+        bot.add_batch_listening(print, ['message', 'callback_query'])
+        self.assertEqual(sorted(bot._allowed_updates()), ['callback_query', 'message'])
+
+
+class MetaCache(unittest.TestCase):
+    '''A class for testing the cache of get_me, get_chat and get_chat_member'''
+
+    def test_hits_and_ttl(self):
+        '''The value is requested once while it is alive'''
+
+        cache = meta_cache.MetaCache(ttls={'get_chat': 0.05})
+        calls = []
+        load = lambda: calls.append(1) or {'id': 5}
+
+        for i in range(3):
+            self.assertEqual(cache.get('get_chat', ('5',), load), {'id': 5})
+        self.assertEqual(len(calls), 1)
+
+        time.sleep(0.06)
+        cache.get('get_chat', ('5',), load)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(cache.stats()['hits'], 2)
+
+
+    def test_negative(self):
+        '''"Chat not found" is stored, network errors are not'''
+
+        cache = meta_cache.MetaCache()
+        not_found = Exception('chat not found')
+        not_found.error_code = 400
+        calls = []
+
+        def load(error):
+            calls.append(1)
+            raise error
+
+        for i in range(2):
+            with self.assertRaises(Exception):
+                cache.get('get_chat', ('1',), lambda: load(not_found))
+            with self.assertRaises(ConnectionError):
+                cache.get('get_chat', ('2',), lambda: load(ConnectionError()))
+
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(cache.stats()['negative_hits'], 1)
+
+
+    def test_negative_traceback(self):
+        '''Each raise of the stored error gets a copy with its own short traceback'''
+
+        cache = meta_cache.MetaCache()
+        not_found = Exception('chat not found')
+        not_found.error_code = 400
+
+        def load():
+            raise not_found
+
+        depths = []
+        for i in range(100):
+            try:
+                cache.get('get_chat', ('1',), load)
+            except Exception as err:
+                self.assertEqual(err.error_code, 400)
+                self.assertEqual(err.args, ('chat not found',))
+                depth, tb = 0, err.__traceback__
+                while tb is not None:
+                    depth, tb = depth + 1, tb.tb_next
+                depths.append(depth)
+
+        self.assertEqual(max(depths[1:]), depths[1])
+
+
+    def test_negative_telegram_errors(self):
+        '''The errors of telebot and of NotifyApi are raised again as they are, although their __init__ takes other parameters'''
+
+        import telebot
+
+        result = SimpleNamespace(status_code=400, reason='Bad Request')
+        errors = [
+            telebot.apihelper.ApiTelegramException('getChat', result, {'error_code': 400, 'description': 'Bad Request: chat not found'}),
+            notify.TelegramError('getChat', 400, 'Bad Request: chat not found'),
+        ]
+
+        for error in errors:
+            cache = meta_cache.MetaCache()
+
+            def load():
+                raise error
+
+            for i in range(2):
+                with self.assertRaises(type(error)) as raised:
+                    cache.get('get_chat', ('1',), load)
+
+                self.assertIsNot(raised.exception, error)
+                self.assertEqual(raised.exception.error_code, 400)
+                self.assertEqual(raised.exception.description, 'Bad Request: chat not found')
+                self.assertEqual(str(raised.exception), str(error))
+
+            self.assertEqual(cache.stats()['negative_hits'], 1)
+
+
+    def test_single_flight(self):
+        '''Simultaneous misses of one key make one request'''
+
+        import threading
+        cache = meta_cache.MetaCache()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def load():
+            calls.append(1)
+            started.set()
+            release.wait(1)
+            return 'me'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get('get_me', (), load))) for i in range(5)]
+        threads[0].start()
+        started.wait(1)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ['me'] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.stats()['shared'] + cache.stats()['hits'], 4)
+
+
+class Circuit(unittest.TestCase):
+    '''A class for testing the circuit breaker of requests to telegram'''
+
+    def test_open_and_probe(self):
+        '''Failures open the circuit, the probe after the pause closes it'''
+
+        breaker = circuit.CircuitBreaker(min_calls=3, base_delay=0.05, jitter=0)
+        for i in range(3):
+            self.assertEqual(breaker.acquire(), 0.0)
+            breaker.record(True)
+
+        self.assertEqual(breaker.state, circuit.OPEN)
+        self.assertGreater(breaker.acquire(), 0.0)
+        with self.assertRaises(circuit.CircuitOpenError):
+            breaker.call(lambda: None)
+
+        time.sleep(0.06)
+        self.assertEqual(breaker.acquire(), 0.0)
+        self.assertEqual(breaker.state, circuit.HALF_OPEN)
+        self.assertGreater(breaker.acquire(), 0.0) #only one probe at a time
+
+        breaker.record(False)
+        self.assertEqual(breaker.state, circuit.CLOSED)
+        self.assertEqual(breaker.stats()['opened'], 1)
+
+
+    def test_backoff_and_errors(self):
+        '''A failed probe doubles the pause, errors of the request do not open the circuit'''
+
+        breaker = circuit.CircuitBreaker(min_calls=1, base_delay=1, jitter=0)
+        breaker.record(True)
+        self.assertAlmostEqual(breaker.stats()['retry_in'], 1, places=1)
+
+        breaker._open_until = 0
+        breaker.acquire()
+        breaker.record(True)
+        self.assertAlmostEqual(breaker.stats()['retry_in'], 2, places=1)
+
+        not_found = Exception('chat not found')
+        not_found.error_code = 400
+        self.assertFalse(breaker.is_failure(not_found))
+        self.assertTrue(breaker.is_failure(ConnectionError()))
+        self.assertFalse(breaker.is_failure(ValueError()))
+
+
+    def test_outbound_buffer(self):
+        '''While the circuit is open, requests wait in the queue and are sent after the probe'''
+
+        breaker = circuit.CircuitBreaker(min_calls=1, base_delay=0.1, jitter=0)
+        scheduler_ = outbound.OutboundScheduler(rate=1000, burst=100, workers=2)
+        scheduler_.circuit = breaker
+
+        breaker.record(True)
+        futures = [scheduler_.submit(lambda i=i: i) for i in range(3)]
+        time.sleep(0.05)
+        self.assertFalse(any(future.done() for future in futures))
+        self.assertEqual(scheduler_.stats()['normal']['queued'], 3)
+
+        self.assertEqual([future.result(timeout=1) for future in futures], [0, 1, 2])
+        self.assertEqual(breaker.state, circuit.CLOSED)
+        scheduler_.stop()
+
+
+    def test_buffer_limit(self):
+        '''When the lane is full, the oldest request is dropped'''
+
+        breaker = circuit.CircuitBreaker(min_calls=1, base_delay=60, jitter=0)
+        scheduler_ = outbound.OutboundScheduler(workers=1, max_queued=2)
+        scheduler_.circuit = breaker
+
+        breaker.record(True)
+        futures = [scheduler_.submit(lambda i=i: i) for i in range(3)]
+
+        self.assertIsInstance(futures[0].exception(timeout=1), outbound.QueueOverflow)
+        self.assertFalse(futures[1].done())
+        self.assertEqual(scheduler_.stats()['normal']['dropped'], 1)
+        scheduler_.stop()
+
+        #While telegram works, a broadcast longer than the limit is not cut
+        healthy = outbound.OutboundScheduler(rate=1000, burst=100, workers=1, max_queued=2)
+        healthy.circuit = circuit.CircuitBreaker()
+        futures = [healthy.submit(lambda i=i: i) for i in range(10)]
+        self.assertEqual([future.result(timeout=1) for future in futures], list(range(10)))
+        self.assertEqual(healthy.stats()['normal']['dropped'], 0)
+        healthy.stop()
+
+
+    def test_cancelled_probe(self):
+        '''A request cancelled while the circuit is open does not keep the probe: the next request closes the circuit'''
+
+        breaker = circuit.CircuitBreaker(min_calls=1, base_delay=0.05, jitter=0)
+        scheduler_ = outbound.OutboundScheduler(rate=1000, burst=100, workers=1)
+        scheduler_.circuit = breaker
+
+        breaker.record(True)
+        self.assertTrue(scheduler_.submit(lambda: 1).cancel())
+        time.sleep(0.1)
+
+        self.assertEqual(scheduler_.submit(lambda: 2).result(timeout=1), 2)
+        self.assertEqual(breaker.state, circuit.CLOSED)
+        self.assertFalse(breaker.blocked())
+
+        #The probe taken by a request that was not sent is given back
+        breaker.record(True)
+        time.sleep(0.1)
+        self.assertEqual(breaker.acquire(), 0.0)
+        self.assertTrue(breaker.blocked())
+        breaker.release_probe()
+        self.assertFalse(breaker.blocked())
+        scheduler_.stop()
+
+
+    def test_fail_fast(self):
+        '''While the circuit is open, calls of the bot do not wait, and the probe of polling is a short request'''
+
+        import basic_bot
+
+        bot = basic_bot.TelegramBotParent('1:TOKEN')
+        bot.circuit = circuit.CircuitBreaker(min_calls=1, base_delay=0.05, jitter=0)
+        bot.outbound.circuit = bot.circuit
+        bot.circuit.record(True)
+
+        self.assertTrue(bot.circuit.blocked())
+        with self.assertRaises(circuit.CircuitOpenError):
+            bot.reply('text', 1)
+
+        requests = []
+        bot.api.get_updates = lambda **kwargs: requests.append(kwargs) or []
+        bot._wrap_circuit()
+        bot.api.get_updates(offset=1, timeout=20, long_polling_timeout=20)
+
+        self.assertEqual(requests, [{'offset': 1, 'timeout': 1, 'long_polling_timeout': 1}])
+        self.assertEqual(bot.circuit.state, circuit.CLOSED)
+
+
+if __name__ == '__main__':
+    unittest.main()